@@ -4,27 +4,99 @@ import os
 import threading
 import sys
 import time
-from .lime import DirectoryTree
+import io
+import codecs
+import hashlib
+import collections
+import contextlib
+import functools
+import heapq
+import itertools
+import json
+import multiprocessing
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .lime import DirectoryTree, Manifest
+from . import watcher
 
 wsh = None
+# fields to detect changed files
+STATE_FIELDS = ('path', 'mtime', 'fsize')
+# block size to read files
+READ_BLOCK = 64 * 1024
+# threads reading files to find lines of search results
+SCAN_THREADS = 8
+# max number of lines in search results
+MAX_HITS = 10000
+# number of path groups scanned at once while searching
+SCAN_BATCH = 100
+# seconds between quick panel updates while searching
+PANEL_REFRESH = 0.5
+# max length of line text shown in the quick panel
+PANEL_TEXT_LENGTH = 200
+# seconds to gather saved files into one index update
+SAVE_DELAY = 1.0
+# segments of a tier merged at once by the tiered merge policy
+MERGE_FANIN = 10
+# max megabytes of segments rewritten by one commit
+MAX_MERGE_MB = 32
+# seconds without index updates before deferred merges run
+MERGE_DELAY = 30
+# seconds between checks whether the editor is idle
+IDLE_CHECK = 10
+# milliseconds to wait after a modification before indexing the view
+OVERLAY_DELAY = 500
+# milliseconds to wait for the next key before searching as you type
+TYPING_DELAY = 150
+# number of indexes whose searchers are kept open
+MAX_OPEN_INDEXES = 4
+# best files taken from each index in a search of several projects
+FEDERATED_HITS = 500
+# table of contents file of an index, "_<name>_<generation>.toc"
+TOC_PATTERN = re.compile(r'^_(.+)_[0-9]+\.toc$')
 
 class Const:
-    now_indexing = False
-    opts = None
-    ix = None
-    cache_ix = None
-
-
-def get_dirtree(projname):
-    with Const.cache_ix.searcher() as searcher:
-        try:
-            return searcher.document(name=projname)
-        except KeyError:
+    dirtrees = {}
+    manifests = {}
+    watchers = {}
+    # Project by name
+    projects = {}
+    # project of the window used last
+    active_project = None
+    # searcher managers, least recently used first
+    searcher_managers = collections.OrderedDict()
+    searcher_managers_lock = threading.Lock()
+    # Project of the indexes opened only to be searched with other projects
+    # by (indexdir, name), or None for indexes which are not project indexes
+    federated = {}
+    # number of indexes searched by the last federated search
+    federated_count = 0
+    tiered_merge = None
+    optimizer = None
+    last_activity = time.time()
+    last_search = None
+
+
+def get_manifest(projname):
+    manifest = Const.manifests.get(projname)
+    if manifest is None:
+        path = os.path.join(load_index_dir(), projname + '.manifest')
+        manifest = Const.manifests[projname] = Manifest(path)
+    return manifest
+
+
+def get_dirtree(project):
+    dt = Const.dirtrees.get(project.name)
+    if dt is None:
+        dt = DirectoryTree(project.opts['folders'])
+        if not get_manifest(project.name).load(dt):
             return None
+        Const.dirtrees[project.name] = dt
+    return dt
 
 def set_dirtree(projname, dt):
-    with Const.cache_ix.writer() as writer:
-        writer.add_document(name=projname, tree=dt)
+    Const.dirtrees[projname] = dt
+    get_manifest(projname).save(dt)
 
 
 def plugin_loaded():
@@ -37,12 +109,27 @@ def plugin_loaded():
     import whoosh.fields
     import whoosh.qparser
     import whoosh.query
+    import whoosh.multiproc
+    import whoosh.columns
+    import whoosh.formats
+    import whoosh.analysis
+    import whoosh.collectors
+    import whoosh.searching
+    import whoosh.reading
+    import whoosh.filedb.filestore
+    import whoosh.writing
+    import whoosh.codec.whoosh4
     global SCHEMA
-    SCHEMA = wsh.fields.Schema(path=wsh.fields.ID(stored=True), mtime=wsh.fields.STORED, fsize=wsh.fields.STORED,
-                               data=wsh.fields.NGRAM(stored=False, phrase=True, minsize=2, maxsize=2))
-    Const.cache_ix = open_ix(load_index_dir(), '__Searchlime_cache__', create=True,
-                             schema=wsh.fields.Schema(name=wsh.fields.ID(stored=True), tree=wsh.fields.STORED)
-                             )
+    SCHEMA = wsh.fields.Schema(path=wsh.fields.ID(stored=True, sortable=True),
+                               mtime=wsh.fields.COLUMN(wsh.columns.NumericColumn('q')),
+                               fsize=wsh.fields.COLUMN(wsh.columns.NumericColumn('q')),
+                               hash=wsh.fields.ID(stored=True),
+                               content=wsh.fields.ID(stored=True),
+                               data=wsh.fields.NGRAM(stored=False, phrase=True, minsize=2, maxsize=2),
+                               trigram=wsh.fields.FieldType(wsh.formats.Existence(), wsh.analysis.NgramAnalyzer(3)))
+    Const.tiered_merge = wsh.writing.TieredMerge(MERGE_FANIN, MAX_MERGE_MB)
+    Const.optimizer = IdleOptimizer()
+    sublime.set_timeout_async(Const.optimizer.tick, IDLE_CHECK * 1000)
 
 
 def care_path(path):
@@ -119,6 +206,33 @@ def load_options(window):
     options['exclude_files'] = set(options['exclude_files'])
     options['exclude_dirs'] = set(options['exclude_dirs'])
     options['include_patterns'] = set(options['include_patterns'])
+    # indexing workers
+    options['indexing_processes'] = project_settings.get(
+        'indexing_processes', settings.get('indexing_processes', 1))
+    # directory scanning
+    options['scan_engine'] = settings.get('scan_engine')
+    options['scan_threads'] = settings.get('scan_threads', 1)
+    options['watch'] = settings.get('watch', False)
+    # reading files
+    options['max_indexed_size'] = project_settings.get(
+        'max_indexed_size', settings.get('max_indexed_size', 2 * 1024 * 1024))
+    options['encodings'] = project_settings.get(
+        'encodings', settings.get('encodings', ['utf-8']))
+    # share one document between identical files
+    options['dedup'] = project_settings.get('dedup', settings.get('dedup', False))
+    # "phrase" or "trigram"
+    options['search_engine'] = project_settings.get(
+        'search_engine', settings.get('search_engine', 'phrase'))
+    options['search_as_you_type'] = settings.get('search_as_you_type', False)
+    # indexes searched together by a search of several projects
+    options['federated_projects'] = project_settings.get(
+        'federated_projects', settings.get('federated_projects'))
+    # "tiered" or "small"
+    options['merge_policy'] = settings.get('merge_policy', 'tiered')
+    options['defer_merges'] = settings.get('defer_merges', False)
+    # "w3" or "w4"
+    options['posting_codec'] = settings.get('posting_codec', 'w3')
+    options['optimize_when_idle'] = settings.get('optimize_when_idle')
     projname = get_project_name(window)
     if not projname:
         return
@@ -140,55 +254,930 @@ def load_options(window):
     return options
 
 
-def readfile(path):
+class Project:
+
+    '''options, index and indexing state of a project. every project has its
+    own, so windows of different projects index and search independently.
+    '''
+
+    def __init__(self, name, opts):
+        self.name = name
+        self.opts = opts
+        self.ix = None
+        self.indexing = False
+        self.lock = threading.Lock()
+        self.save_queue = SaveQueue(self)
+        self.overlay = None
+        self.merge_timer = None
+        # bytes written to segments, and bytes of new documents in them
+        self.write_stats = {'commits': 0, 'written': 0, 'merged': 0, 'ingested': 0}
+
+    def open_index(self, recreate=False):
+        self.ix = open_ix(self.opts['indexdir'], self.name, create=True, recreate=recreate)
+        return self.ix
+
+    def start_indexing(self):
+        # returns False if the project is being indexed already
+        with self.lock:
+            if self.indexing:
+                return False
+            self.indexing = True
+        Const.optimizer.pause(self)
+        return True
+
+    def finish_indexing(self):
+        self.indexing = False
+
+    def readfile(self, path):
+        return readfile(path, self.opts.get('max_indexed_size'), self.opts.get('encodings', ('utf-8',)))
+
+    def text_field(self):
+        # the field file contents are indexed in. "phrase" engine indexes
+        # bigrams with positions, "trigram" engine indexes trigrams without
+        # positions.
+        if self.opts.get('search_engine') == 'trigram':
+            if self.ix is None or 'trigram' in self.ix.schema:
+                return 'trigram'
+        return 'data'
+
+    def uses_trigrams(self, searcher):
+        return self.opts.get('search_engine') == 'trigram' and 'trigram' in searcher.schema
+
+
+def get_project(window, reload=False):
+    '''returns the Project of the window, or None. options are loaded the
+    first time, or again if reload is True.
+    '''
+    projname = get_project_name(window)
+    if not projname:
+        return None
+    project = Const.projects.get(projname)
+    if project is None or reload:
+        opts = load_options(window)
+        if opts is None:
+            return None
+        if project is None:
+            project = Const.projects[projname] = Project(projname, opts)
+        project.opts = opts
+    if project.ix is None:
+        project.open_index()
+    Const.active_project = projname
+    return project
+
+
+def readfile(path, max_size=None, encodings=('utf-8',)):
+    '''read a text file block by block, at most max_size bytes.
+    returns '' if the file looks binary or cannot be decoded with any of
+    encodings.
+    '''
     try:
-        return open(path, encoding='utf-8').read()
-    except UnicodeDecodeError:
+        f = open(path, 'rb')
+    except OSError:
         return ''
+    with f:
+        if max_size is None:
+            max_size = float('inf')
+        head = f.read(min(READ_BLOCK, max_size))
+        if b'\0' in head:
+            return ''
+        for encoding in encodings:
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), True)
+            f.seek(len(head))
+            try:
+                chunks = [decoder.decode(head)]
+                size = len(head)
+                while size < max_size:
+                    block = f.read(min(READ_BLOCK, max_size - size))
+                    if not block:
+                        chunks.append(decoder.decode(b'', final=True))
+                        break
+                    size += len(block)
+                    chunks.append(decoder.decode(block))
+            except (UnicodeDecodeError, LookupError):
+                continue
+            # a character cut at max_size stays in the decoder
+            return ''.join(chunks)
+    return ''
 
 
 def readdata(view):
     return view.substr(sublime.Region(0, view.size()))
 
 
-def update_index(paths, callback=None, remove=True):
-    ix = Const.ix
-    with ix.searcher() as searcher:
-        with ix.writer(limitmb=256) as writer:
-            # remove non-existing paths
-            if remove:
-                remove_paths = []
-                for path in searcher.field_terms('path'):
-                    if path not in paths:
-                        remove_paths.append(path)
-                for path in remove_paths:
-                    writer.delete_by_term('path', path)
-            # update existing paths
-            for path in paths:
-                fstat = os.stat(path)
-                mtime, fsize = fstat.st_mtime_ns, fstat.st_size
-                doc = searcher.document(path=path)
-                if not doc or doc['mtime'] != mtime or fsize != doc['fsize']:
-                    writer.delete_by_term('path', path)
-                    data = readfile(path)
-                    if data:
-                        writer.add_document(path=path, data=data, mtime=mtime, fsize=fsize)
+def index_fields(fields, opts, field):
+    # fill the document fields of the path. in parallel mode, this runs in the
+    # worker processes of MpWriter. files not indexed (binary, empty, too
+    # large, ...) keep a document without text, so that they are not read
+    # again until they change.
+    if field in fields or 'content' in fields:
+        return fields  # content is already read (dedup mode)
+    data = readfile(fields['path'], opts.get('max_indexed_size'), opts.get('encodings', ('utf-8',)))
+    if data:
+        fields[field] = data
+    return fields
+
+
+def process_context():
+    # multiprocessing context of the indexing and merging processes, None for
+    # the default one, or False if processes cannot be used. they have to be
+    # forked: a spawned process runs plugin_host, which cannot import the
+    # whoosh of this package.
+    if not hasattr(multiprocessing, 'get_context'):
+        # before Python 3.4, processes are forked on every platform but Windows
+        return False if os.name == 'nt' else None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    return multiprocessing.get_context('fork')
+
+
+def open_writer(project, parallel=True):
+    procs = 1
+    if parallel:
+        procs = project.opts.get('indexing_processes', 1) or 1
+    context = process_context()
+    if context is False:
+        procs = 1
+    codec = posting_codec(project.opts)
+    if procs > 1:
+        docfilter = functools.partial(index_fields, opts=project.opts, field=project.text_field())
+        writer = wsh.multiproc.MpWriter(project.ix, procs=procs, docfilter=docfilter, mpcontext=context,
+                                        limitmb=max(32, 256 // procs), codec=codec)
+    else:
+        writer = project.ix.writer(limitmb=256, codec=codec)
+    writer.mergetype = merge_policy(project.opts)
+    return writer
+
+
+def posting_codec(opts):
+    # codec of new segments. segments keep the codec they were written with,
+    # so segments of both codecs are searched and merged together.
+    if opts.get('posting_codec') == 'w4':
+        return wsh.codec.whoosh4.W4Codec()
+    return wsh.codec.default_codec()
+
+
+def merge_policy(opts):
+    if opts.get('defer_merges'):
+        return wsh.writing.NO_MERGE
+    if opts.get('merge_policy', 'tiered') == 'tiered':
+        return Const.tiered_merge
+    return wsh.writing.MERGE_SMALL
+
+
+def segment_sizes(ix):
+    return dict((seg.segment_id(), wsh.writing.TieredMerge.segment_size(ix.storage, seg))
+                for seg in ix._segments())
+
+
+def record_write(project, before):
+    # count the bytes a commit wrote. before is segment_sizes() before the
+    # commit. segments gone after the commit were merged into the new ones.
+    after = segment_sizes(project.ix)
+    written = sum(size for segid, size in after.items() if segid not in before)
+    merged = sum(size for segid, size in before.items() if segid not in after)
+    stats = project.write_stats
+    stats['commits'] += 1
+    stats['written'] += written
+    stats['merged'] += merged
+    stats['ingested'] += max(written - merged, 0)
+    print('Searchlime: {}: wrote {} KB, merged {} KB, write amplification {:.2f}'.format(
+        project.name, written // 1024, merged // 1024, write_amplification(stats)))
+
+
+def write_amplification(stats):
+    return stats['written'] / max(stats['ingested'], 1)
+
+
+def schedule_merge(project):
+    # merge segments when the index is not updated for a while
+    if project.merge_timer:
+        project.merge_timer.cancel()
+    project.merge_timer = threading.Timer(MERGE_DELAY, merge_segments, args=(project,))
+    project.merge_timer.daemon = True
+    project.merge_timer.start()
+
+
+def merge_segments(project):
+    ix = project.ix
+    if ix is None:
+        return
+    if not project.start_indexing():
+        schedule_merge(project)
+        return
+    try:
+        policy = Const.tiered_merge
+        # one commit rewrites at most MAX_MERGE_MB, merge until no tier is full
+        while policy.select(ix.storage, ix._segments())[0]:
+            before = segment_sizes(ix)
+            ix.writer(codec=posting_codec(project.opts)).commit(mergetype=policy)
+            record_write(project, before)
+    finally:
+        project.finish_indexing()
+
+
+def _leaf_states(leaf, docnums=None):
+    # yield (path, (mtime, fsize)) of live documents in a leaf reader.
+    # columns are used when the segment has them, older indexes only have
+    # stored fields.
+    if all(leaf.has_column(name) for name in STATE_FIELDS):
+        columns = [leaf.column_reader(name) for name in STATE_FIELDS]
+        if docnums is None:
+            deleted = leaf.has_deletions() and leaf.is_deleted
+            for docnum, (path, mtime, fsize) in enumerate(zip(*columns)):
+                # content documents of dedup mode have no path
+                if path and not (deleted and deleted(docnum)):
+                    yield path, (mtime, fsize)
+        else:
+            for docnum in docnums:
+                path, mtime, fsize = [c[docnum] for c in columns]
+                yield path, (mtime, fsize)
+    else:
+        if docnums is None:
+            docs = leaf.iter_docs()
+        else:
+            docs = ((docnum, leaf.stored_fields(docnum)) for docnum in docnums)
+        for _, doc in docs:
+            if doc.get('path'):
+                yield doc['path'], (doc.get('mtime'), doc.get('fsize'))
+
+
+def indexed_files(searcher, paths=None):
+    '''returns {path: (mtime, fsize)} of the indexed documents.
+    if paths is given, only these paths are looked up.
+    '''
+    reader = searcher.reader()
+    leaves = reader.leaf_readers()
+    files = {}
+    if paths is None:
+        for leaf, _ in leaves:
+            files.update(_leaf_states(leaf))
+        return files
+    # map global document numbers to the leaf readers
+    docnums = [[] for _ in leaves]
+    for path in paths:
+        docnum = searcher.document_number(path=path)
+        if docnum is None:
+            continue
+        for i, (_, offset) in reversed(list(enumerate(leaves))):
+            if docnum >= offset:
+                docnums[i].append(docnum - offset)
+                break
+    for (leaf, _), nums in zip(leaves, docnums):
+        if nums:
+            files.update(_leaf_states(leaf, nums))
+    return files
+
+
+def diff_files(indexed, paths, remove=True):
+    '''compare the indexed states with the files on disk.
+    returns (added, modified, removed), added and modified are lists of
+    (path, mtime, fsize) and removed is a list of paths.
+    '''
+    added = []
+    modified = []
+    current = set()
+    for path in paths:
+        try:
+            fstat = os.stat(path)
+        except OSError:
+            continue
+        current.add(path)
+        state = (fstat.st_mtime_ns, fstat.st_size)
+        old = indexed.get(path)
+        if old is None:
+            added.append((path,) + state)
+        elif old != state:
+            modified.append((path,) + state)
+    removed = []
+    for path in indexed:
+        if path not in current and (remove or path in paths):
+            removed.append(path)
+    return added, modified, removed
+
+
+class IndexingStats:
+
+    '''per-phase timers and counters of an index update. the phases of the
+    whoosh writer (analyzing, spilling postings, merging and flushing
+    segments) are added from its statistics, summed over worker processes.
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = collections.OrderedDict()
+        self.counts = collections.Counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+
+    def add_writer(self, writer):
+        for name, value in writer.indexing_stats().items():
+            if name.endswith('_time'):
+                # reading files in the worker processes
+                name = 'read' if name == 'filter_time' else name[:-len('_time')]
+                self.phases[name] = self.phases.get(name, 0.0) + value
+            else:
+                self.counts[name] += value
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return {
+            'elapsed': elapsed,
+            'files_per_sec': self.counts['files'] / elapsed,
+            'bytes_per_sec': self.counts['bytes'] / elapsed,
+            'postings_per_sec': self.counts['postings'] / elapsed,
+            'phases': self.phases,
+            'counts': self.counts,
+        }
+
+    def summary(self):
+        report = self.report()
+        text = '{} files, {:.0f} files/s, {:.1f} MB/s, {:.0f} postings/s'.format(
+            self.counts['files'], report['files_per_sec'],
+            report['bytes_per_sec'] / 1024 / 1024, report['postings_per_sec'])
+        if self.phases:
+            name = max(self.phases, key=self.phases.get)
+            text += ', slowest: {} {:.1f}s'.format(name, self.phases[name])
+        return text
+
+    def dump(self, project):
+        # next to the index, e.g. "foo.sublime-project.stats.json"
+        report = self.report()
+        report['project'] = project.name
+        report['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        path = os.path.join(project.opts['indexdir'], project.name + '.stats.json')
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            print('Searchlime: cannot write {}: {}'.format(path, e))
+
+
+def update_index(project, paths, callback=None, remove=True, stats=None):
+    '''updates the index of project with the files of paths, and returns the
+    IndexingStats of the update. stats may have the phases timed before.
+    '''
+    stats = stats or IndexingStats()
+    ix = project.ix
+    manager = searcher_manager(ix)
+    with manager.lease() as searcher, stats.phase('lookup'):
+        if remove:
+            indexed = indexed_files(searcher)
+        else:
+            indexed = indexed_files(searcher, paths)
+    with stats.phase('stat'):
+        added, modified, removed = diff_files(indexed, paths, remove)
+    if callback:
+        callback(len(paths) - len(added) - len(modified))
+    if not (added or modified or removed):
+        return stats
+    stats.counts['files'] += len(added) + len(modified)
+    stats.counts['bytes'] += sum(fsize for _, _, fsize in added + modified)
+    stats.counts['removed'] += len(removed)
+    # a single file (e.g. on save) is not worth starting worker processes
+    parallel = len(added) + len(modified) > 1
+    dedup = dedup_enabled(project)
+    before = segment_sizes(ix)
+    with manager.lease() as searcher:
+        with open_writer(project, parallel) as writer:
+            for path in removed:
+                writer.delete_by_term('path', path)
+            for path, _, _ in modified:
+                writer.delete_by_term('path', path)
+            refs = collections.Counter()
+            files = added + modified
+            contents = read_contents(project, files) if dedup else None
+            for path, mtime, fsize in files:
+                fields = dict(path=path, mtime=mtime, fsize=fsize)
+                if dedup:
+                    with stats.phase('read'):
+                        fields = next(contents)
+                    fields = add_content(project, searcher, writer, fields, refs)
+                elif not isinstance(writer, wsh.multiproc.MpWriter):
+                    with stats.phase('read'):
+                        fields = index_fields(fields, project.opts, project.text_field())
+                writer.add_document(**fields)
                 if callback:
                     callback()
-
-
-def update_index_with_view(view):
-    if not Const.opts:
-        print('Searchlime: error: cannot find options')
-        return
-    dt = get_dirtree(Const.opts['project_name'])
+            if 'content' in ix.schema:
+                release_contents(searcher, writer, removed + [m[0] for m in modified], refs)
+    stats.add_writer(writer)
+    record_write(project, before)
+    stats.dump(project)
+    print('Searchlime: {}: {}'.format(project.name, stats.summary()))
+    Const.last_activity = time.time()
+    if project.opts.get('defer_merges'):
+        schedule_merge(project)
+    return stats
+
+
+def dedup_enabled(project):
+    return bool(project.opts.get('dedup')) and 'hash' in project.ix.schema
+
+
+def read_contents(project, files):
+    '''dedup mode: yields the fields of the (path, mtime, fsize) files with
+    their text and its hash, if they are indexed. files are read and hashed
+    in a thread pool, SCAN_BATCH files at a time.
+    '''
+    field = project.text_field()
+    def read(file):
+        path, mtime, fsize = file
+        fields = index_fields(dict(path=path, mtime=mtime, fsize=fsize), project.opts, field)
+        if field in fields:
+            fields['hash'] = hashlib.sha1(fields[field].encode('utf-8')).hexdigest()
+        return fields
+
+    with ThreadPoolExecutor(SCAN_THREADS) as pool:
+        for start in range(0, len(files), SCAN_BATCH):
+            for fields in pool.map(read, files[start:start + SCAN_BATCH]):
+                yield fields
+
+
+def add_content(project, searcher, writer, fields, refs):
+    '''dedup mode: the content of identical files is analyzed once in a
+    content document (hash, data), and each file gets a path document which
+    refers to it (path, mtime, fsize, content). fields come from
+    read_contents; a file not indexed keeps its path document only.
+    '''
+    field = project.text_field()
+    if field not in fields:
+        return fields
+    data = fields.pop(field)
+    chash = fields.pop('hash')
+    if not refs[chash] and searcher.document_number(hash=chash) is None:
+        writer.add_document(**{'hash': chash, field: data})
+    refs[chash] += 1
+    fields['content'] = chash
+    return fields
+
+
+def release_contents(searcher, writer, paths, refs):
+    # delete content documents no path refers to anymore. refs counts the
+    # references added by this update.
+    released = collections.Counter()
+    for path in paths:
+        doc = searcher.document(path=path)
+        if doc and doc.get('content'):
+            released[doc['content']] += 1
+    for chash, n in released.items():
+        live = sum(1 for _ in searcher.document_numbers(content=chash))
+        if live - n + refs[chash] <= 0:
+            writer.delete_by_term('hash', chash)
+
+
+def trigram_query(text):
+    grams = sorted(set(text[i:i + 3] for i in range(len(text) - 2)))
+    if grams:
+        return wsh.query.And([wsh.query.Term('trigram', g) for g in grams])
+    # shorter than a trigram: it is the head or the tail of some trigrams
+    query = wsh.query.Prefix('trigram', text)
+    if not set(text) & set('*?'):
+        query = wsh.query.Or([query, wsh.query.Wildcard('trigram', '*' + text)])
+    return query
+
+
+def search_query(project, searcher, text):
+    if project.uses_trigrams(searcher):
+        # candidates, verified later by searching the literal text in the files
+        return trigram_query(text.lower())
+    if len(text) == 1:
+        return wsh.query.Prefix('data', text)
+    return wsh.qparser.QueryParser('data', searcher.schema).parse('"{}"'.format(text))
+
+
+def iter_candidates(searcher, query, token, overlay=None):
+    '''yields the path groups of the documents matching query, segment by
+    segment. paths in overlay are taken from the overlay segments only.
+    raises SearchCancelled once token is set.
+    '''
+    for subsearcher, _ in searcher.leaf_searchers():
+        collector = wsh.collectors.CancelCollector(wsh.collectors.UnsortedCollector(), token)
+        subsearcher.search_with_collector(query, collector)
+        shadowed = overlay.texts if overlay and not overlay.owns(subsearcher.reader()) else ()
+        groups = []
+        for docnum in sorted(collector.results().docs()):
+            paths = hit_paths(searcher, subsearcher.stored_fields(docnum))
+            paths = [path for path in paths if path not in shadowed]
+            if paths:
+                groups.append(paths)
+        yield groups
+
+
+def iter_hits(project, searcher, text, token, limit=MAX_HITS, extra=(), overlay=None):
+    '''yields batches of (path, line, column, line text) hits of text. the
+    extra paths (e.g. files not indexed yet) are scanned too. searcher is to
+    be combined with the overlay, whose texts are scanned instead of files.
+    raises SearchCancelled once token is set.
+    '''
+    texts = overlay.texts if overlay else {}
+    query = search_query(project, searcher, text)
+    count = 0
+    seen = set()
+
+    def batches():
+        for groups in iter_candidates(searcher, query, token, overlay):
+            seen.update(path for paths in groups for path in paths)
+            yield groups
+        yield [[path] for path in sorted(set(extra) - seen)]
+
+    with ThreadPoolExecutor(SCAN_THREADS) as pool:
+        for groups in batches():
+            for start in range(0, len(groups), SCAN_BATCH):
+                if token.is_set():
+                    raise wsh.searching.SearchCancelled
+                hits = scan_lines(project, pool, groups[start:start + SCAN_BATCH], text, limit - count, texts)
+                count += len(hits)
+                yield hits
+                if count >= limit:
+                    return
+
+
+def intersect_term(searcher, fieldname, text, docs):
+    '''returns the documents of docs containing the term. the posting list of
+    the term is skipped to each document instead of being read through.
+    '''
+    found = set()
+    for subsearcher, offset in searcher.leaf_searchers():
+        reader = subsearcher.reader()
+        end = offset + reader.doc_count_all()
+        subdocs = sorted(d - offset for d in docs if offset <= d < end)
+        if not subdocs:
+            continue
+        try:
+            matcher = reader.postings(fieldname, text)
+        except wsh.reading.TermNotFound:
+            continue
+        for docnum in subdocs:
+            if matcher.id() < docnum:
+                matcher.skip_to(docnum)
+            if not matcher.is_active():
+                break
+            if matcher.id() == docnum:
+                found.add(docnum + offset)
+    return found
+
+
+class RefiningSearch:
+
+    '''candidate documents of a query being typed. when the query extends the
+    previous one, the previous candidates are narrowed down by the n-grams the
+    query gained instead of running the whole query again.
+    '''
+
+    def __init__(self, project):
+        self.project = project
+        self.manager = searcher_manager(project.ix)
+        self.searcher = self.manager.acquire()
+        if project.uses_trigrams(self.searcher):
+            self.fieldname, self.size = 'trigram', 3
+        else:
+            self.fieldname, self.size = 'data', 2
+        self.text = None
+        self.docs = None
+
+    def grams(self, text):
+        return set(text[i:i + self.size] for i in range(len(text) - self.size + 1))
+
+    def candidates(self, text):
+        text = text.lower()
+        if self.text is not None and self.text in text and not set(text) & set('*?'):
+            # the documents containing text contain the previous text too
+            for gram in sorted(self.grams(text) - self.grams(self.text)):
+                if not self.docs:
+                    break
+                self.docs = intersect_term(self.searcher, self.fieldname, gram, self.docs)
+        else:
+            query = search_query(self.project, self.searcher, text)
+            self.docs = set(self.searcher.search(query, limit=None).docs())
+        self.text = text
+        return self.docs
+
+    def hits(self, pool, text, limit):
+        '''returns the first hits of text in the candidate files'''
+        items = []
+        docs = sorted(self.candidates(text))
+        for start in range(0, len(docs), SCAN_BATCH):
+            groups = [hit_paths(self.searcher, self.searcher.stored_fields(d))
+                      for d in docs[start:start + SCAN_BATCH]]
+            items.extend(scan_lines(self.project, pool, [g for g in groups if g], text, limit - len(items)))
+            if len(items) >= limit:
+                break
+        return items
+
+    def close(self):
+        self.manager.release(self.searcher)
+
+
+def find_lines(data, text):
+    '''returns (line, column, line text) of each occurrence of text (lower case)
+    in data. line and column start at 1.
+    '''
+    lower = data.lower()
+    hits = []
+    lineno, linestart = 1, 0
+    pos = lower.find(text)
+    while pos >= 0:
+        lineno += lower.count('\n', linestart, pos)
+        linestart = lower.rfind('\n', 0, pos) + 1
+        lineend = lower.find('\n', pos)
+        if lineend < 0:
+            lineend = len(data)
+        hits.append((lineno, pos - linestart + 1, data[linestart:lineend]))
+        pos = lower.find(text, pos + 1)
+    return hits
+
+
+def scan_lines(project, pool, groups, text, limit=MAX_HITS, texts=None):
+    '''returns (path, line, column, line text) hits of text in the groups of
+    paths. files are read in the thread pool, and a group of identical files
+    is read once. files not read yet when limit is reached are skipped.
+    texts maps paths to contents used instead of the files.
+    '''
+    text = text.lower()
+    texts = texts or {}
+    items = []
+    def scan(paths):
+        data = texts.get(paths[0])
+        if data is None:
+            data = project.readfile(paths[0])
+        return find_lines(data, text)
+
+    futures = [pool.submit(scan, paths) for paths in groups]
+    try:
+        for paths, future in zip(groups, futures):
+            hits = future.result()
+            for path in paths:
+                items.extend((path,) + hit for hit in hits)
+            if len(items) > limit:
+                break
+    finally:
+        # files not read yet are not needed anymore
+        for future in futures:
+            future.cancel()
+    return items[:limit]
+
+
+def scored_groups(project, searcher, text, token, limit, overlay=None):
+    '''returns (score, paths) of the best documents matching text, best
+    first. leaves are searched one by one, scored with the statistics of the
+    whole index. paths in overlay are taken from the overlay segments only.
+    '''
+    query = search_query(project, searcher, text)
+    found = []
+    for subsearcher, _ in searcher.leaf_searchers():
+        collector = wsh.collectors.CancelCollector(wsh.collectors.TopCollector(limit), token)
+        subsearcher.search_with_collector(query, collector)
+        shadowed = overlay.texts if overlay and not overlay.owns(subsearcher.reader()) else ()
+        for hit in collector.results():
+            paths = hit_paths(searcher, hit.fields())
+            paths = [path for path in paths if path not in shadowed]
+            if paths:
+                found.append((hit.score or 0, paths))
+    found.sort(key=lambda item: -item[0])
+    return found[:limit]
+
+
+def federated_projects(project):
+    '''returns project and the projects searched together with it: the
+    "federated_projects" option, or every index in indexdir. indexes of
+    projects not opened in this session are opened with the search engine
+    they were built with, and kept open for the next searches.
+    '''
+    opts = project.opts
+    names = opts.get('federated_projects')
+    listed = names is not None
+    if not listed:
+        names = index_names(opts['indexdir'])
+    projects = [project]
+    for name in names:
+        if name == project.name:
+            continue
+        other = Const.projects.get(name)
+        if other is None or other.ix is None:
+            other = open_federated(opts, name, listed)
+            if other is None:
+                continue
+        projects.append(other)
+    # keep the searchers of all of them open
+    Const.federated_count = len(projects)
+    return projects
+
+
+def open_federated(opts, name, listed):
+    # returns the Project searching the index name of indexdir, or None if it
+    # does not exist or is not a project index. both projects and indexes
+    # which are not project indexes are remembered.
+    key = (opts['indexdir'], name)
+    if key in Const.federated:
+        return Const.federated[key]
+    ix = open_ix(opts['indexdir'], name)
+    if ix is None:
+        print('Searchlime: index of {} not found'.format(name))
+        return None
+    project = None
+    if 'data' in ix.schema or 'trigram' in ix.schema:
+        project = Project(name, dict(opts, project_name=name, search_engine=index_engine(ix)))
+        project.ix = ix
+    else:
+        # not a project index, e.g. the __Searchlime_cache__ index of older
+        # versions
+        if listed:
+            print('Searchlime: {} is not a project index'.format(name))
+        ix.close()
+    Const.federated[key] = project
+    return project
+
+
+def federated_hits(projects, text, token, limit=MAX_HITS):
+    '''yields batches of (path, line, column, line text) hits of text in the
+    indexes of projects. every index is searched in its own thread, and the
+    best files of the indexes are merged by score. an index that cannot be
+    searched is skipped. a path indexed by several projects is listed once.
+    raises SearchCancelled once token is set.
+    '''
+    def search(order):
+        project = projects[order]
+        try:
+            with searcher_manager(project.ix).lease() as searcher:
+                overlay = project.overlay.snapshot() if project.overlay else None
+                if overlay:
+                    searcher = overlay.searcher(searcher)
+                found = scored_groups(project, searcher, text, token, FEDERATED_HITS, overlay)
+        except wsh.searching.SearchCancelled:
+            raise
+        except Exception as e:
+            # a broken index does not stop the search of the others
+            print('Searchlime: cannot search {}: {}'.format(project.name, e))
+            return []
+        texts = overlay.texts if overlay else {}
+        # sorted by the first three items, which are unique
+        return [(-score, order, rank, paths, texts) for rank, (score, paths) in enumerate(found)]
+
+    count = 0
+    seen = set()
+    with ThreadPoolExecutor(SCAN_THREADS) as pool:
+        ranked = list(pool.map(search, range(len(projects))))
+        merged = heapq.merge(*ranked)
+        while count < limit:
+            chunk = list(itertools.islice(merged, SCAN_BATCH))
+            if not chunk:
+                return
+            if token.is_set():
+                raise wsh.searching.SearchCancelled
+            hits = []
+            for order, entries in itertools.groupby(chunk, lambda entry: entry[1]):
+                groups = []
+                for _, _, _, paths, texts in entries:
+                    paths = [path for path in paths if path not in seen]
+                    seen.update(paths)
+                    if paths:
+                        groups.append(paths)
+                hits.extend(scan_lines(projects[order], pool, groups, text, limit - count - len(hits), texts))
+            count += len(hits)
+            yield hits
+
+
+def hit_paths(searcher, hit):
+    # paths of a search hit. a content document expands to every path
+    # referring to it.
+    path = hit.get('path')
+    if path:
+        return [path]
+    return [doc['path'] for doc in searcher.documents(content=hit['hash'])]
+
+
+def update_index_with_view(project, view):
+    dt = get_dirtree(project)
     if dt is None:
         print('Searchlime: error: cannot find files')
         return
     path = view.file_name()
     if path not in dt.cached_paths():
         return
-    update_index([path], remove=False)
+    project.save_queue.add(path)
+
+
+class Overlay:
+
+    '''unsaved contents of modified views, indexed in memory. searched
+    together with the index on disk, its documents shadow the on-disk
+    documents of the same paths.
+    '''
+
+    def __init__(self, schema, field):
+        self.ix = wsh.filedb.filestore.RamStorage().create_index(schema)
+        self.field = field
+        self.texts = {}
+        self.lock = threading.Lock()
+
+    def update(self, path, text):
+        with self.lock:
+            with self.ix.writer() as writer:
+                writer.delete_by_term('path', path)
+                writer.add_document(**{'path': path, self.field: text})
+            self.texts[path] = text
+
+    def discard(self, path):
+        with self.lock:
+            if self.texts.pop(path, None) is not None:
+                with self.ix.writer() as writer:
+                    writer.delete_by_term('path', path)
+
+    def snapshot(self):
+        '''returns the current overlay to search, or None if it is empty'''
+        with self.lock:
+            if not self.texts:
+                return None
+            return OverlaySnapshot(self.ix.reader(), dict(self.texts))
+
+
+class OverlaySnapshot:
+
+    def __init__(self, reader, texts):
+        self.reader = reader
+        self.texts = texts
+        self.leaves = [r for r, _ in reader.leaf_readers()]
+
+    def owns(self, reader):
+        return any(reader is leaf for leaf in self.leaves)
+
+    def searcher(self, base):
+        # base and the overlay in one MultiReader. closing it leaves the
+        # readers of base open.
+        readers = [r for r, _ in base.reader().leaf_readers()] + self.leaves
+        return wsh.searching.Searcher(wsh.reading.MultiReader(readers), closereader=False)
+
+
+def get_overlay(project):
+    overlay = project.overlay
+    field = project.text_field()
+    if overlay is None or overlay.field != field or overlay.ix.schema.names() != project.ix.schema.names():
+        overlay = project.overlay = Overlay(project.ix.schema, field)
+    return overlay
+
+
+def update_overlay_with_view(project, view):
+    dt = get_dirtree(project)
+    path = view.file_name()
+    if dt is None or path not in dt.cached_paths():
+        return
+    overlay = get_overlay(project)
+    if view.is_dirty():
+        overlay.update(path, readdata(view))
+    else:
+        overlay.discard(path)
+
+
+class SaveQueue:
+
+    '''gathers the files saved within delay seconds and updates them in one
+    commit. searches also scan the files waiting here.
+    '''
+
+    def __init__(self, project, delay=SAVE_DELAY):
+        self.project = project
+        self.delay = delay
+        self.pending = set()
+        # files being updated, not committed yet
+        self.flushing = set()
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, path):
+        with self.lock:
+            self.pending.add(path)
+            if self.timer is None:
+                self._schedule()
+
+    def paths(self):
+        with self.lock:
+            return self.pending | self.flushing
+
+    def _schedule(self):
+        self.timer = threading.Timer(self.delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if not self.project.start_indexing():
+                # try again after the running update
+                self._schedule()
+                return
+            self.pending, self.flushing = set(), self.pending
+            self.timer = None
+        try:
+            update_index(self.project, sorted(self.flushing), remove=False)
+        finally:
+            with self.lock:
+                self.flushing = set()
+            self.project.finish_indexing()
 
 
 def open_ix(indexdir, name, create=False, recreate=False, schema=None):
@@ -197,6 +1186,7 @@ def open_ix(indexdir, name, create=False, recreate=False, schema=None):
     if not name:
         return None
     if recreate:
+        drop_searcher_manager(indexdir, name)
         return wsh.index.create_in(indexdir, schema, indexname=name)
     elif wsh.index.exists_in(indexdir, indexname=name):
         return wsh.index.open_dir(indexdir, indexname=name)
@@ -204,43 +1194,232 @@ def open_ix(indexdir, name, create=False, recreate=False, schema=None):
         return wsh.index.create_in(indexdir, schema, indexname=name)
 
 
-def create_directory_tree():
-    opts = Const.opts
-    if not opts:
-        print('Searchlime: error: cannot find options')
-    return DirectoryTree(opts['folders'])
-
-
-def walk(directory, exclude_dirs=set(), exclude_files=set(), followlinks=False):
-    drs = [directory]
-    visited = set(drs)
-    while drs:
-        newdrs = []
-        for dr in drs:
-            for entry in os.listdir(dr):
-                path = care_path(os.path.join(dr, entry))
-                st = os.stat(path)
-                if stat.S_ISLNK(st.st_mode) and not followlinks:
-                    continue
-                if stat.S_ISREG(st.st_mode):
-                    if not match_pattern(path, exclude_files):
-                        yield path
-                elif stat.S_ISDIR(st.st_mode):
-                    if path in visited:
-                        continue
-                    visited.add(path)
-                    if not match_pattern(path, exclude_dirs):
-                        newdrs.append(path)
-        drs = newdrs
-
-
-def match_pattern(s, patterns):
-    for pat in patterns:
-        if fnmatch.fnmatch(s, pat):
-            return True
-        if s.endswith(pat):
-            return True
-    return False
+def index_names(indexdir):
+    # names of the indexes in indexdir
+    names = set()
+    for filename in os.listdir(indexdir):
+        match = TOC_PATTERN.match(filename)
+        if match:
+            names.add(match.group(1))
+    return sorted(names)
+
+
+def index_engine(ix):
+    # search engine the index was built with
+    with ix.reader() as reader:
+        return 'trigram' if 'trigram' in reader.indexed_field_names() else 'phrase'
+
+
+class SearcherManager:
+
+    '''keeps one searcher of an index open and lends it to threads. after a
+    commit, the searcher is refreshed and only the changed segments are
+    reopened. a searcher replaced while lent is closed by its last lease.
+    once the manager is closed, every lease gets its own searcher.
+    '''
+
+    def __init__(self, ix):
+        self.ix = ix
+        self.searcher = None
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self):
+        with self.lock:
+            searcher = self.searcher
+            if self.closed:
+                # evicted while a thread held on to the manager: the searcher
+                # is not kept, and release closes it
+                searcher = self.ix.searcher()
+                self.leases[id(searcher)] = 1
+                return searcher
+            if searcher is None:
+                searcher = self.ix.searcher()
+            elif not searcher.up_to_date():
+                if self.leases.get(id(searcher)):
+                    # refresh closes the readers of removed segments, which
+                    # are still in use
+                    searcher = self.ix.searcher()
+                else:
+                    searcher = searcher.refresh()
+            self.searcher = searcher
+            self.leases[id(searcher)] = self.leases.get(id(searcher), 0) + 1
+            return searcher
+
+    def release(self, searcher):
+        with self.lock:
+            self.leases[id(searcher)] -= 1
+            if self.leases[id(searcher)]:
+                return
+            del self.leases[id(searcher)]
+            if searcher is not self.searcher:
+                searcher.close()
+
+    @contextlib.contextmanager
+    def lease(self):
+        searcher = self.acquire()
+        try:
+            yield searcher
+        finally:
+            self.release(searcher)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            searcher, self.searcher = self.searcher, None
+            if searcher and not self.leases.get(id(searcher)):
+                searcher.close()
+
+
+def searcher_manager(ix):
+    # searchers of the MAX_OPEN_INDEXES indexes used last are kept open, or of
+    # as many as the last federated search used
+    key = (ix.storage.folder, ix.indexname)
+    with Const.searcher_managers_lock:
+        manager = Const.searcher_managers.pop(key, None)
+        if manager is None:
+            manager = SearcherManager(ix)
+        Const.searcher_managers[key] = manager
+        while len(Const.searcher_managers) > max(MAX_OPEN_INDEXES, Const.federated_count):
+            _, old = Const.searcher_managers.popitem(last=False)
+            old.close()
+    return manager
+
+
+def drop_searcher_manager(indexdir, name):
+    with Const.searcher_managers_lock:
+        manager = Const.searcher_managers.pop((indexdir, name), None)
+    if manager:
+        manager.close()
+
+
+class IdleOptimizer:
+
+    '''merges all segments of the index in a separate process while the editor
+    is idle. indexing pauses it by stopping the process, and it starts again
+    at the next idle time.
+    '''
+
+    def __init__(self):
+        self.task = None
+        self.project = None
+        self.lock = threading.Lock()
+
+    def tick(self):
+        # optimize the index of the project used last
+        project = Const.projects.get(Const.active_project)
+        idle = project and project.opts.get('optimize_when_idle')
+        if idle and project.ix and not project.indexing and time.time() - Const.last_activity > idle:
+            self.start(project)
+        sublime.set_timeout_async(self.tick, IDLE_CHECK * 1000)
+
+    def start(self, project):
+        ix = project.ix
+        context = process_context()
+        if context is False:
+            # no process can be started: merge the full tiers in a thread
+            # instead, as deferred merges do
+            threading.Thread(target=merge_segments, args=(project,)).start()
+            return
+        # project.lock keeps indexing from starting before the task is
+        # registered, so that start_indexing can pause it
+        with project.lock, self.lock:
+            if self.task or project.indexing:
+                return
+            before = len(ix._segments())
+            if before <= 1:
+                return
+            elapsed = probe_search(project)
+            cls = wsh.multiproc.context_class(wsh.multiproc.OptimizeTask, context)
+            task = self.task = cls(ix.storage, ix.indexname, MERGE_FANIN, posting_codec(project.opts))
+            self.project = project
+            task.start()
+        tr = threading.Thread(target=self.report, args=(project, task, before, elapsed))
+        tr.start()
+
+    def pause(self, project=None):
+        # stop merging the index of project, or any index
+        with self.lock:
+            if project is not None and project is not self.project:
+                return
+            task, self.task = self.task, None
+        if task and task.is_alive():
+            task.terminate()
+            task.join()
+
+    def report(self, project, task, before, elapsed):
+        task.join()
+        with self.lock:
+            paused = self.task is not task
+            if not paused:
+                self.task = None
+        message = 'Searchlime: {}: {} segments merged into {}'.format(
+            project.name, before, len(project.ix._segments()))
+        if paused:
+            message += ' (paused)'
+        if elapsed is not None:
+            message += ', query {:.1f} ms -> {:.1f} ms'.format(elapsed * 1000, probe_search(project) * 1000)
+        print(message)
+        sublime.status_message(message)
+
+
+def probe_search(project):
+    # seconds to find the candidates of the last search with a new searcher
+    text = Const.last_search
+    if not text:
+        return None
+    best = None
+    for _ in range(3):
+        start = time.time()
+        with project.ix.searcher() as searcher:
+            searcher.search(search_query(project, searcher, text), limit=None).docs()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def watch_project(project, dt):
+    # keep watching the directories of the project tree
+    projname = project.name
+    w = Const.watchers.get(projname)
+    if not project.opts.get('watch') or not watcher.is_supported():
+        if w:
+            w.close()
+            del Const.watchers[projname]
+        return
+    if w is None:
+        w = Const.watchers[projname] = watcher.InotifyWatcher()
+    try:
+        w.watch(dt.tree_cache)
+    except watcher.WatchLimitExceeded:
+        print('Searchlime: too many directories to watch, fall back to scanning')
+        w.close()
+        del Const.watchers[projname]
+
+
+def watched_changes(projname, dt):
+    '''returns paths to update from the changes the watcher found since the
+    last call, or None if the project tree has to be scanned.
+    '''
+    w = Const.watchers.get(projname)
+    if w is None or not w.healthy() or dt.item_cache is None:
+        return None
+    changes = w.take()
+    if changes is None:
+        return None
+    changed, changed_dirs = changes
+    old = set(dt.cached_paths())
+    new = old
+    if changed_dirs:
+        # re-read only the directories whose entries were changed
+        dt.invalidate(changed_dirs)
+        new = set(dt.paths())
+    return list((old ^ new) | (changed & new))
+
+
+def create_directory_tree(opts):
+    return DirectoryTree(opts['folders'], opts['scan_engine'], opts['scan_threads'])
 
 
 class SearchlimeUpdateIndexCommand(sublime_plugin.WindowCommand):
@@ -249,42 +1428,55 @@ class SearchlimeUpdateIndexCommand(sublime_plugin.WindowCommand):
 
     def run(self):
         if is_enabled(self.window):
-            if not Const.now_indexing:
-                Const.now_indexing = True
-                tr = threading.Thread(target=self.run_indexing)
+            project = get_project(self.window, reload=True)
+            if project is None:
+                print('Searchlime: cannnot load options')
+                return
+            if project.start_indexing():
+                tr = threading.Thread(target=self.run_indexing, args=(project,))
                 tr.start()
         else:
             self.window.active_view().set_status("Searchlime", "Searchlime is disabled")
 
-    def run_indexing(self):
-        Const.opts = load_options(self.window)
-        if Const.opts is None:
-            print('Searchlime: cannnot load options')
-            return
+    def run_indexing(self, project):
+        self.project = project
         self.total_files = 0
         self.num_files = 0
-        projname = Const.opts['project_name']
-        Const.ix = open_ix(Const.opts['indexdir'], projname, create=True)
-        if not Const.ix:
-            self.window.active_view().set_status("Searchlime", "indexdir open error")
-        dt = get_dirtree(projname)
-        if not dt:
-            dt = create_directory_tree()
-        self.window.active_view().set_status("Searchlime", "Scan project tree...")
-        paths = dt.paths()
-        set_dirtree(projname, dt)
-        self.total_files = len(paths)
-        self.update_status()
-        update_index(paths, callback=self.increment_index_count)
-        Const.now_indexing = False
-        self.window.active_view().set_status("Searchlime", "update index finished.")
-
-
-    def increment_index_count(self):
-        self.num_files += 1
+        projname = project.name
+        # the indexing flag is cleared whatever happens, or saves and merges of
+        # the project would wait for it forever
+        try:
+            if not project.open_index():
+                self.window.active_view().set_status("Searchlime", "indexdir open error")
+                return
+            dt = get_dirtree(project)
+            if not dt:
+                dt = create_directory_tree(project.opts)
+            dt.set_info(project.opts['folders'])
+            dt.set_engine(project.opts['scan_engine'], project.opts['scan_threads'])
+            stats = IndexingStats()
+            with stats.phase('scan'):
+                paths = watched_changes(projname, dt)
+                remove = paths is None
+                if remove:
+                    self.window.active_view().set_status("Searchlime", "Scan project tree...")
+                    paths = dt.paths()
+                    print('Searchlime: {} directories rescanned, {} skipped'.format(paths.rescanned, paths.skipped))
+            set_dirtree(projname, dt)
+            self.total_files = len(paths)
+            self.update_status()
+            update_index(project, paths, callback=self.increment_index_count, remove=remove, stats=stats)
+            watch_project(project, dt)
+        finally:
+            project.finish_indexing()
+        self.window.active_view().set_status("Searchlime", "update index finished. " + stats.summary())
+
+
+    def increment_index_count(self, n=1):
+        self.num_files += n
 
     def update_status(self):
-        if Const.now_indexing:
+        if self.project.indexing:
             percent = 100.0
             if self.total_files > 0:
                 percent = self.num_files / self.total_files * 100
@@ -298,30 +1490,34 @@ class SearchlimeReindexCommand(SearchlimeUpdateIndexCommand):
     def __init__(self, window):
         super().__init__(window)
 
-    def run_indexing(self):
-        Const.opts = load_options(self.window)
-        if Const.opts is None:
-            print('Searchlime: cannnot load options')
-            return
+    def run_indexing(self, project):
+        self.project = project
         self.total_files = 0
         self.num_files = 0
-        projname = Const.opts['project_name']
+        projname = project.name
         # reindex whole project
-        ix = open_ix(opts['indexdir'], projectname, recreate=True)
-        if not ix:
-            self.window.active_view().set_status("Searchlime", "indexdir open error")
-        Const.ix = ix
-        dt = get_dirtree(projname)
-        if not dt:
-            dt = create_directory_tree()
-        self.window.active_view().set_status("Searchlime", "Scan project tree...")
-        paths = dt.paths()
-        set_dirtree(projname, dt)
-        self.total_files = len(paths)
-        self.update_status()
-        update_index(paths, callback=self.increment_index_count)
-        Const.now_indexing = False
+        try:
+            if not project.open_index(recreate=True):
+                self.window.active_view().set_status("Searchlime", "indexdir open error")
+                return
+            dt = get_dirtree(project)
+            if not dt:
+                dt = create_directory_tree(project.opts)
+            dt.set_info(project.opts['folders'])
+            dt.set_engine(project.opts['scan_engine'], project.opts['scan_threads'])
+            self.window.active_view().set_status("Searchlime", "Scan project tree...")
+            stats = IndexingStats()
+            with stats.phase('scan'):
+                paths = dt.paths()
+            print('Searchlime: {} directories rescanned, {} skipped'.format(paths.rescanned, paths.skipped))
+            set_dirtree(projname, dt)
+            self.total_files = len(paths)
+            self.update_status()
+            update_index(project, paths, callback=self.increment_index_count, stats=stats)
+        finally:
+            project.finish_indexing()
         self.window.active_view().erase_status("Searchlime")
+        sublime.status_message("Searchlime: reindex finished. " + stats.summary())
 
 
 class SearchlimeEventListener(sublime_plugin.EventListener):
@@ -365,62 +1561,141 @@ class SearchlimeSearchCommand(sublime_plugin.WindowCommand):
         self.found_regions = None
         self.region_index = None
         self.item_index = None
-
-    def run(self):
+        self.items = []
+        self.cancel_token = None
+        self.panel_open = False
+        self.panel_refreshing = False
+        # text typed in the input panel, and its candidates
+        self.typed = None
+        self.refining = None
+        self.project = None
+        # search the indexes of other projects too
+        self.federated = False
+
+    def run(self, federated=False):
         view = self.window.active_view()
         selection_text = view.substr(view.sel()[0])
         if is_enabled(self.window):
-            self.window.show_input_panel("Searchlime:", selection_text or self.search_for, self.search, None, None)
+            self.current_view = view
+            self.project = get_project(self.window)
+            self.federated = federated
+            on_change = None
+            if self.project and self.project.opts.get('search_as_you_type'):
+                on_change = self.on_change
+            self.window.show_input_panel("Searchlime:", selection_text or self.search_for,
+                                         self.search, on_change, self.on_cancel)
             return
         sublime.error_message("Searchlime disabled")
 
+    def on_change(self, text):
+        self.typed = text
+        # search when no key is typed for a while
+        sublime.set_timeout_async(lambda: self.refine(text), TYPING_DELAY)
+
+    def refine(self, text):
+        if text != self.typed:
+            return
+        if not text or self.project is None:
+            self.current_view.erase_status("Searchlime")
+            return
+        if self.refining is None:
+            self.refining = RefiningSearch(self.project)
+        with ThreadPoolExecutor(SCAN_THREADS) as pool:
+            hits = self.refining.hits(pool, text, 1)
+        status = "search: {} candidates: {}".format(text, len(self.refining.docs))
+        if hits:
+            status += " first: {}:{}".format(hits[0][0], hits[0][1])
+        self.current_view.set_status("Searchlime", status)
+
+    def stop_refining(self):
+        # runs in the async thread after the pending refine calls
+        if self.refining:
+            self.refining.close()
+            self.refining = None
+
+    def on_cancel(self):
+        self.typed = None
+        self.current_view.erase_status("Searchlime")
+        sublime.set_timeout_async(self.stop_refining, 0)
+
     def search(self, search_for):
+        Const.last_search = search_for
+        self.typed = None
+        sublime.set_timeout_async(self.stop_refining, 0)
         self.searching = True
         self.search_for = search_for
-        tr = threading.Thread(target=self.run_search)
+        # a newer search cancels the running one
+        if self.cancel_token:
+            self.cancel_token.set()
+        self.cancel_token = threading.Event()
+        tr = threading.Thread(target=self.run_search, args=(search_for, self.cancel_token))
         tr.start()
 
-    def run_search(self):
-        ix = Const.ix
-        if ix is None:
+    def run_search(self, search_for, token):
+        project = self.project
+        if project is None:
             sublime.error_message("Searchlime indexdir not founed")
             return
-        opts = Const.opts
-        if opts is None:
-            print('Searchlime: error: cannot find options')
-        self.items = []
-        parser = wsh.qparser.QueryParser('data', ix.schema)
-        with ix.searcher() as searcher:
-            if len(self.search_for) == 1:
-                query = wsh.query.Prefix('data', self.search_for)
-            else:
-                query = parser.parse('"{}"'.format(self.search_for))
-            for hit in searcher.search(query):
-                self.items.append(hit.get('path'))
-                if len(self.items) > 10000:
-                    break
+        # items are (path, line, column, line text)
+        self.items = items = []
+        self.item_index = 0
         self.current_view = self.window.active_view()
+        shown = time.time()
+        try:
+            with contextlib.ExitStack() as stack:
+                if self.federated:
+                    batches = federated_hits(federated_projects(project), search_for, token)
+                else:
+                    searcher = stack.enter_context(searcher_manager(project.ix).lease())
+                    extra = project.save_queue.paths()
+                    overlay = get_overlay(project).snapshot()
+                    if overlay:
+                        searcher = overlay.searcher(searcher)
+                    batches = iter_hits(project, searcher, search_for, token, extra=extra, overlay=overlay)
+                for hits in batches:
+                    items.extend(hits)
+                    # show the hits found so far
+                    if items and time.time() - shown > PANEL_REFRESH:
+                        self.__class__.instance = self
+                        self.show_quick_panel(max(self.item_index, 0))
+                        shown = time.time()
+        except wsh.searching.SearchCancelled:
+            return
+        if token.is_set():
+            return
         if self.items:
             self.__class__.instance = self
-        self.show_quick_panel()
+        self.show_quick_panel(max(self.item_index, 0))
 
     def show_quick_panel(self, start=0):
+        # the panel being replaced calls on_done(-1)
+        self.panel_refreshing = self.panel_open
+        self.panel_open = True
         if self.items:
             self.item_index = start
-            self.window.show_quick_panel(self.items, self.on_done, 0, start, self.on_highlighted)
+            panel_items = [['{}:{}'.format(path, line), text.strip()[:PANEL_TEXT_LENGTH]]
+                           for path, line, _, text in self.items]
+            self.window.show_quick_panel(panel_items, self.on_done, 0, start, self.on_highlighted)
         else:
             self.window.show_quick_panel(["No results"], self.on_done_none)
 
     def on_done(self, index):
+        if index == -1 and self.panel_refreshing:
+            self.panel_refreshing = False
+            return
+        self.panel_open = False
+        # stop searching when the panel is closed
+        if self.cancel_token:
+            self.cancel_token.set()
         if index == -1:
             self.window.focus_view(self.current_view)
             flush_key(self.current_view)
             if self.active_view:
                 flush_key(self.active_view)
         else:
-            path = self.items[index]
             if not self.active_view:
-                self.active_view = self.window.open_file(path)
+                self.active_view = self.window.open_file(encoded_position(self.items[index]),
+                                                         sublime.ENCODED_POSITION)
             move_to_view_thread = threading.Thread(target=self.move_to_view)
             move_to_view_thread.start()
         self.__class__.instance = None
@@ -438,35 +1713,51 @@ class SearchlimeSearchCommand(sublime_plugin.WindowCommand):
         flush_key(view)
         view.show_at_center(rg)
 
-    def show_view(self, view):
+    def show_view(self, view, item):
         while view.is_loading():
             time.sleep(0.05)
         if self.active_view != view:
-            self.found_regions = view.find_all(self.search_for, sublime.IGNORECASE)
-            self.region_index = 0
+            self.found_regions = view.find_all(self.search_for, sublime.IGNORECASE | sublime.LITERAL)
             if self.active_view:
                 flush_key(self.active_view)
         self.active_view = view
+        # select the region of the highlighted line
+        _, line, col, _ = item
+        point = view.text_point(line - 1, col - 1)
+        self.region_index = 0
+        for i, region in enumerate(self.found_regions):
+            if region.begin() == point:
+                self.region_index = i
+                break
         highlight_regions(view, self.found_regions)
         if self.found_regions:
             move_cursor_to_target(view, self.found_regions[self.region_index])
 
     def on_done_none(self, index):
+        if index == -1 and self.panel_refreshing:
+            self.panel_refreshing = False
+            return
+        self.panel_open = False
         flush_key(self.current_view)
 
     def on_highlighted(self, index):
         self.item_index = index
         if index != -1:
-            path = self.items[index]
-            view = self.window.open_file(path, sublime.TRANSIENT)
-            show_view_thread = threading.Thread(target=self.show_view, args=(view,))
+            item = self.items[index]
+            view = self.window.open_file(encoded_position(item), sublime.ENCODED_POSITION | sublime.TRANSIENT)
+            show_view_thread = threading.Thread(target=self.show_view, args=(view, item))
             show_view_thread.start()
-            view.set_status("Searchlime", "search: {} found: {} files ".format(self.search_for, len(self.items)))
+            view.set_status("Searchlime", "search: {} found: {} lines ".format(self.search_for, len(self.items)))
         else:
             self.window.focus_view(self.current_view)
             flush_key(self.current_view)
 
 
+def encoded_position(item):
+    path, line, col, _ = item
+    return '{}:{}:{}'.format(path, line, col)
+
+
 def move_cursor_to_target(view, csr):
     topl = view.rowcol(view.visible_region().begin())[0]
     bottoml = view.rowcol(view.visible_region().end())[0]
@@ -500,30 +1791,51 @@ class SearchlimeUpdateEvent(sublime_plugin.EventListener):
 
 
     def on_post_save_async(self, view):
-        window = view.window()
-        if self.can_update_view_of_index(window):
-            Const.now_indexing = True
-            update_index_with_view(view)
-            Const.now_indexing = False
-
-
-    def can_update_view_of_index(self, window):
-        if window and Const.opts and Const.ix and not Const.now_indexing:
-            projname = get_project_name(window)
-            if not projname:
-                return False
-            if projname == Const.opts['project_name']:
-                return True
-        return False
+        project = self.indexed_project(view.window())
+        if project:
+            update_index_with_view(project, view)
+            update_overlay_with_view(project, view)
+
+    def on_modified_async(self, view):
+        Const.last_activity = time.time()
+        # index the view when it is not modified for a while
+        change_count = view.change_count()
+        sublime.set_timeout_async(lambda: self.update_overlay(view, change_count), OVERLAY_DELAY)
+
+    def update_overlay(self, view, change_count):
+        if view.change_count() != change_count:
+            return
+        project = self.indexed_project(view.window())
+        if project:
+            update_overlay_with_view(project, view)
+
+    def on_close(self, view):
+        # unsaved contents are gone
+        path = view.file_name()
+        if path:
+            for project in list(Const.projects.values()):
+                if project.overlay:
+                    project.overlay.discard(path)
+
+
+    def indexed_project(self, window):
+        # the project of the window, if its index is open
+        if window:
+            project = Const.projects.get(get_project_name(window))
+            if project and project.ix:
+                return project
+        return None
 
     def will_be_call(self, window):
         if not window:
             return False
         projname = get_project_name(window)
-        if not projname:
+        if not projname or not is_enabled(window):
             return False
-        if not Const.opts or projname != Const.opts['project_name']:
-            Const.opts = load_options(window)
-            if not Const.opts:
-                return False
+        Const.active_project = projname
+        # index a project the first time one of its windows is activated.
+        # watched projects are cheap to update, so update them every time.
+        project = Const.projects.get(projname)
+        if project is None:
             return True
+        return projname in Const.watchers
@@ -0,0 +1,140 @@
+'''Compare the integer encodings of the W4 posting codec on a Searchlime index.
+
+usage: python bench/bench_codecs.py [index directory] [index name]
+
+The document ID deltas and the position deltas of every posting block of the
+index are encoded and decoded with each encoding, and with the pickle and zlib
+blocks of the whoosh3 codec for comparison. Without an index directory, an
+index of this repository's files is created in a temporary directory.
+Speeds are in MB/s of 32-bit integers.
+'''
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'whoosh_2_5_4'))
+from whoosh import fields, index  # noqa: E402
+from whoosh.codec import whoosh4  # noqa: E402
+from whoosh.util.numlists import delta_encode  # noqa: E402
+
+BLOCK = 128
+
+
+class Pickled:
+    '''the posting blocks of the whoosh3 codec: pickled and compressed'''
+
+    @staticmethod
+    def encode_ints(nums, encodings, compression):
+        return 0, zlib.compress(pickle.dumps(nums, -1), compression)
+
+    @staticmethod
+    def decode_ints(code, bs, n):
+        return pickle.loads(zlib.decompress(bs))
+
+
+# (name, codec, encodings, zlib compression level)
+CODECS = [
+    ('packed', whoosh4, (), 0),
+    ('for', whoosh4, (whoosh4.INTS_FOR,), 0),
+    ('simple16', whoosh4, (whoosh4.INTS_SIMPLE16,), 0),
+    ('gints', whoosh4, (whoosh4.INTS_GINTS,), 0),
+    ('varints', whoosh4, (whoosh4.INTS_VARINTS,), 0),
+    ('for+zlib', whoosh4, (whoosh4.INTS_FOR,), 3),
+    ('chosen', whoosh4, whoosh4.DEFAULT_ENCODINGS, 3),
+    ('pickle', Pickled, (), 3),
+]
+
+
+def make_index(root):
+    '''indexes the repository's files the way Searchlime does'''
+    schema = fields.Schema(path=fields.ID(stored=True),
+                           data=fields.NGRAM(stored=False, phrase=True, minsize=2, maxsize=2))
+    ix = index.create_in(root, schema)
+    writer = ix.writer()
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if not name.endswith(('.py', '.md', '.txt', '.sublime-settings')):
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, encoding='utf-8', errors='replace') as f:
+                writer.add_document(path=path, data=f.read())
+    writer.commit()
+    return ix
+
+
+def posting_blocks(ix):
+    '''returns the docid deltas and the position deltas of every block'''
+    ids, positions = [], []
+    with ix.reader() as reader:
+        for fieldname in ('data', 'trigram'):
+            if fieldname not in reader.indexed_field_names():
+                continue
+            haspositions = reader.schema[fieldname].format.supports('positions')
+            for text in reader.lexicon(fieldname):
+                m = reader.postings(fieldname, text)
+                postings = []
+                while m.is_active():
+                    postings.append((m.id(), m.value_as('positions') if haspositions else None))
+                    m.next()
+                for i in range(0, len(postings), BLOCK):
+                    block = postings[i:i + BLOCK]
+                    ids.append(list(delta_encode(docnum for docnum, _ in block)))
+                    if haspositions:
+                        positions.append([d for _, poslist in block for d in delta_encode(poslist)])
+    return ids, positions
+
+
+def run(blocks, codec, encodings, compression, repeat=3):
+    count = sum(len(nums) for nums in blocks)
+    encode = decode = None
+    for _ in range(repeat):
+        start = time.time()
+        encoded = [codec.encode_ints(nums, encodings, compression) for nums in blocks]
+        elapsed = time.time() - start
+        encode = elapsed if encode is None else min(encode, elapsed)
+        start = time.time()
+        for (code, bs), nums in zip(encoded, blocks):
+            codec.decode_ints(code, bs, len(nums))
+        elapsed = time.time() - start
+        decode = elapsed if decode is None else min(decode, elapsed)
+    size = sum(len(bs) for _, bs in encoded)
+    codes = {}
+    for code, _ in encoded:
+        codes[code] = codes.get(code, 0) + 1
+    mb = count * 4 / 1e6
+    return mb / encode, mb / decode, size * 8.0 / count, codes
+
+
+def main():
+    tmpdir = None
+    if len(sys.argv) > 1:
+        root = os.path.abspath(sys.argv[1])
+        name = sys.argv[2] if len(sys.argv) > 2 else None
+        ix = index.open_dir(root, indexname=name) if name else index.open_dir(root)
+    else:
+        tmpdir = tempfile.mkdtemp()
+        ix = make_index(tmpdir)
+    try:
+        ids, positions = posting_blocks(ix)
+    finally:
+        ix.close()
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    for label, blocks in (('docids', ids), ('positions', positions)):
+        if not blocks:
+            continue
+        print('{}: {} blocks, {} ints'.format(label, len(blocks), sum(len(nums) for nums in blocks)))
+        for name, codec, encodings, compression in CODECS:
+            encode, decode, bits, codes = run(blocks, codec, encodings, compression)
+            print('  {:9} encode {:7.1f} MB/s  decode {:7.1f} MB/s  {:5.2f} bits/int  {}'.format(
+                name, encode, decode, bits, ' '.join('{:#x}:{}'.format(c, n) for c, n in sorted(codes.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''Compare the DirectoryTree engines on a directory tree.
+
+usage: python bench/bench_walker.py [directory] [threads]
+
+Without a directory, a synthetic tree is created in a temporary directory.
+Every run starts from an empty cache, so each directory is fully read.
+'''
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lime  # noqa: E402
+
+PATTERNS = {
+    'file_exclude_patterns': {'*.pyc', '*.pyo', '*.o', '*.so', '*.min.js', '*.png', '*.jpg', '.DS_Store'},
+    'folder_exclude_patterns': {'.git', '.svn', '.hg', 'node_modules', '__pycache__', 'build'},
+    'include_patterns': set(),
+}
+
+
+def make_tree(root, depth=3, dirs=8, files=40):
+    if depth == 0:
+        return
+    for i in range(files):
+        ext = ('.py', '.js', '.pyc', '.txt')[i % 4]
+        with open(os.path.join(root, 'file{}{}'.format(i, ext)), 'w') as f:
+            f.write('x')
+    for i in range(dirs):
+        sub = os.path.join(root, 'dir{}'.format(i))
+        os.mkdir(sub)
+        make_tree(sub, depth - 1, dirs, files)
+
+
+def run(root, engine, threads, repeat=3):
+    info = [dict(path=root, follow_symlinks=False, **PATTERNS)]
+    best = None
+    for _ in range(repeat):
+        tree = lime.DirectoryTree(info, engine, threads)
+        start = time.time()
+        paths = tree.paths()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(paths)
+
+
+def main():
+    tmpdir = None
+    if len(sys.argv) > 1:
+        root = os.path.abspath(sys.argv[1])
+    else:
+        tmpdir = tempfile.mkdtemp()
+        root = tmpdir
+        make_tree(root)
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    # DirectoryTree prints every indexed path
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        results = [('listdir', 1), ('scandir', 1), ('scandir', threads)]
+        results = [(engine, n) + run(root, engine, n) for engine, n in results]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    base = results[0][2]
+    for engine, n, elapsed, count in results:
+        print('{:8} threads={:<3} {:8.3f}s {:8} files  x{:.2f}'.format(
+            engine, n, elapsed, count, base / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''Compare the union and the Block-Max WAND evaluation of many-term OR queries.
+
+usage: python bench/bench_wand.py [index directory] [index name]
+
+Random OR queries of 5 to 40 terms of the data field are searched for their
+top 10 documents, once by scoring every matching document and once with the
+WAND matcher, which skips documents whose upper bound cannot enter the top 10.
+For each query size, the number of matched documents, the number of documents
+the WAND matcher scored, and the search times are printed. Without an index
+directory, an index of this repository's files is created in a temporary
+directory.
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'whoosh_2_5_4'))
+from whoosh import query  # noqa: E402
+from whoosh import index  # noqa: E402
+from bench_codecs import make_index  # noqa: E402
+
+FIELD = 'data'
+LIMIT = 10
+SIZES = (5, 10, 20, 40)
+QUERIES = 20
+
+
+class CountedWandOr(query.WandOr):
+    '''a WandOr that keeps its matchers to count the documents they scored'''
+    matchers = []
+
+    def _matcher(self, subs, searcher, context):
+        m = query.WandOr._matcher(self, subs, searcher, context)
+        CountedWandOr.matchers.append(m)
+        return m
+
+
+def common_terms(searcher, count=500):
+    '''returns the most frequent terms of the field'''
+    reader = searcher.reader()
+    terms = [(reader.doc_frequency(FIELD, text), text) for text in reader.lexicon(FIELD)]
+    terms.sort(reverse=True)
+    return [text for _, text in terms[:count]]
+
+
+def run(searcher, terms, size):
+    matched = scored = 0
+    union = wand = 0.0
+    for _ in range(QUERIES):
+        subs = [query.Term(FIELD, text) for text in random.sample(terms, size)]
+        q = query.Or(subs)
+        q.matcher_type = query.Or.DEFAULT_MATCHER
+        start = time.time()
+        expected = [hit.docnum for hit in searcher.search(q, limit=LIMIT)]
+        union += time.time() - start
+        CountedWandOr.matchers = []
+        start = time.time()
+        found = [hit.docnum for hit in searcher.search(CountedWandOr(subs), limit=LIMIT)]
+        wand += time.time() - start
+        if len(found) != len(expected):
+            raise AssertionError('WAND found {} of {} documents'.format(len(found), len(expected)))
+        matched += len(searcher.search(q, limit=None))
+        scored += sum(getattr(m, 'scored_count', 0) for m in CountedWandOr.matchers)
+    return matched, scored, union, wand
+
+
+def main():
+    random.seed(0)
+    tmpdir = None
+    if len(sys.argv) > 1:
+        root = os.path.abspath(sys.argv[1])
+        name = sys.argv[2] if len(sys.argv) > 2 else None
+        ix = index.open_dir(root, indexname=name) if name else index.open_dir(root)
+    else:
+        tmpdir = tempfile.mkdtemp()
+        ix = make_index(tmpdir)
+    try:
+        with ix.searcher() as searcher:
+            terms = common_terms(searcher)
+            print('{} documents, top {}, {} queries per size'.format(searcher.doc_count(), LIMIT, QUERIES))
+            for size in SIZES:
+                if size > len(terms):
+                    break
+                matched, scored, union, wand = run(searcher, terms, size)
+                print('  {:2} terms  matched {:8}  scored {:8} ({:5.1f}%)  union {:6.3f}s  wand {:6.3f}s'.format(
+                    size, matched, scored, scored * 100.0 / max(matched, 1), union, wand))
+    finally:
+        ix.close()
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
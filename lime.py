@@ -1,6 +1,16 @@
 import os
+import re
 import stat
 import fnmatch
+import json
+import mmap
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ディレクトリのmtimeを信用するまでの秒数
+MTIME_RESOLUTION = 2
 
 
 class DirectoryTree:
@@ -10,7 +20,7 @@ class DirectoryTree:
     Tree情報はキャッシュされ、次回の走査時に効率的に動作する。
     '''
 
-    def __init__(self, info):
+    def __init__(self, info, engine=None, threads=1):
         '''infoには辞書オブジェクトのリストを格納する。
         これはSublimeText標準のフォーマットに準拠する。すなわち、
         info = [
@@ -18,21 +28,155 @@ class DirectoryTree:
            'folder_exclude_patterns': set([...]), 'file_exclude_patterns': set([...])},
         ]
         といったものである。全て存在する必要がある。
+        engineはディレクトリを読む方法で、'scandir'か'listdir'。
+        threadsが2以上ならディレクトリをスレッドプールで並列に読む。
         '''
         self.info = info
+        self.set_engine(engine, threads)
         self.tree_cache = {}
         self.item_cache = []
+        # 前回保存してから内容が変わったディレクトリ
+        self.dirty = set()
+        # 前回読んだ時のディレクトリのmtime
+        self.dir_mtimes = {}
+        # _selectの結果 {(root, dir): (entries, files, subdirs)}
+        self._selected = {}
+        # infoのパターンをコンパイルしたもの {root: (include, file_exclude, folder_exclude)}
+        self._matchers = {}
+        self._lock = threading.Lock()
 
     def set_info(self, info):
+        if info == self.info:
+            return
         self.info = info
+        self._selected = {}
+        self._matchers = {}
+
+    def set_engine(self, engine=None, threads=1):
+        if engine is None:
+            engine = 'scandir' if hasattr(os, 'scandir') else 'listdir'
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: {}'.format(engine))
+        self.engine = engine
+        self.threads = threads
+
+    def invalidate(self, dirs):
+        '''dirsを次のpathsでmtimeに関わらず読み直させる'''
+        for dr in dirs:
+            self.dir_mtimes.pop(dr, None)
 
     def cached_paths(self):
+        '''前回の走査結果を返す。Manifestから読み込んだ直後はキャッシュだけを辿って作る。'''
+        if self.item_cache is None:
+            self.item_cache = self._scan(self._cached_entries)
         return self.item_cache
 
     def paths(self):
-        ''' treeをtop downで走査して返す。返り値はファイルリスト。
+        ''' treeをtop downで走査して返す。返り値はファイルリスト(PathList)。
         ただしキャッシュが古く、同名のディレクトリである可能性がある。
+        mtimeが変わっていないディレクトリは読み直さずにキャッシュを使う。
+        '''
+        self._skipped = 0
+        self._rescanned = 0
+        self._scan_started = time.time()
+        if self.threads > 1:
+            with ThreadPoolExecutor(self.threads) as pool:
+                items = PathList(self._scan(self._entries, pool))
+        else:
+            items = PathList(self._scan(self._entries))
+        items.skipped = self._skipped
+        items.rescanned = self._rescanned
+        self.item_cache = items
+        return items
+
+    def _entries(self, dr):
+        '''ディレクトリを読み、{path: type}を返す。キャッシュにないエントリだけstatする。'''
+        st = os.stat(dr)
+        if not stat.S_ISDIR(st.st_mode):
+            raise NotADirectoryError(dr)
+        mtime = st.st_mtime_ns
+        if dr in self.tree_cache and self.dir_mtimes.get(dr) == mtime:
+            with self._lock:
+                self._skipped += 1
+            return self.tree_cache[dr]
+        with self._lock:
+            self._rescanned += 1
+        old = self.tree_cache.get(dr, {})
+        cache = ENGINES[self.engine](dr, old)
+        # 走査直前に変更されたディレクトリは、同じmtimeのまま更に変更される
+        # 可能性があるので(mtimeの分解能が粗いファイルシステム)、次回も読み直す
+        if mtime / 1e9 >= self._scan_started - MTIME_RESOLUTION:
+            mtime = None
+        if cache != old or dr not in self.tree_cache or self.dir_mtimes.get(dr) != mtime:
+            self.tree_cache[dr] = cache
+            self.dir_mtimes[dr] = mtime
+            self.dirty.add(dr)
+        return self.tree_cache[dr]
+
+    def _cached_entries(self, dr):
+        return self.tree_cache.get(dr, {})
+
+    def _forget(self, dr):
+        '''dr以下のキャッシュを削除する'''
+        removekeys = []
+        for k in list(self.tree_cache):
+            if k == dr or k.startswith(os.path.join(dr, '')):
+                removekeys.append(k)
+        for k in removekeys:
+            del self.tree_cache[k]
+            self.dir_mtimes.pop(k, None)
+            self.dirty.add(k)
+
+    def _get_matchers(self, info):
+        matchers = self._matchers.get(info['path'])
+        if matchers is None:
+            include = None
+            if info['include_patterns']:
+                include = compile_patterns(info['include_patterns'])
+            matchers = self._matchers[info['path']] = (
+                include,
+                compile_patterns(info['file_exclude_patterns']),
+                compile_patterns(info['folder_exclude_patterns']))
+        return matchers
+
+    def _select(self, info, dr, cache):
+        '''ディレクトリのエントリをパターンで選別し、(files, subdirs)を返す。
+        エントリが前回と同じなら前回の結果をそのまま使う。
         '''
+        key = (info['path'], dr)
+        selected = self._selected.get(key)
+        if selected and selected[0] is cache:
+            return selected[1], selected[2]
+        include, file_exclude, folder_exclude = self._get_matchers(info)
+        files = []
+        subdirs = []
+        for path, tp in cache.items():
+            basename = os.path.basename(path)
+            if not tp:
+                continue
+            if not info['follow_symlinks'] and tp[1]:
+                continue  # symlinkを辿らない
+            if tp[0] == 'file':
+                # includeがあるときはこっち優先
+                if include:
+                    if not include(basename):
+                        continue
+                if not file_exclude(basename):
+                    print('[{}] will be indexed'.format(path))
+                    files.append(path)
+            elif tp[0] == 'dir':
+                if not folder_exclude(basename):
+                    subdirs.append(path)
+        self._selected[key] = (cache, files, subdirs)
+        return files, subdirs
+
+    def _scan(self, list_entries, pool=None):
+        def list_one(dr):
+            try:
+                return dr, list_entries(dr)
+            except (NotADirectoryError, FileNotFoundError) as e:
+                return dr, e
+
         items = []
         visited = set()
         for info in self.info:
@@ -40,55 +184,176 @@ class DirectoryTree:
             visited.add(info['path'])
             while drs:
                 newdrs = []
-                for dr in drs:
-                    cache = self.tree_cache.setdefault(dr, {})
+                # 同じ深さのディレクトリはまとめて(poolがあれば並列に)読む
+                if pool and len(drs) > 1:
+                    listed = pool.map(list_one, drs)
+                else:
+                    listed = map(list_one, drs)
+                for dr, cache in listed:
                     # directoryが本当にdirectoryかチェックする
-                    try:
-                        entries = os.listdir(dr)
-                        paths = [os.path.join(dr, x) for x in entries]
-                    except NotADirectoryError:
+                    if isinstance(cache, NotADirectoryError):
                         # rare case. remove cache bwloe this directory, and add file this time
-                        removekeys = []
-                        for k in self.tree_cache.keys():
-                            if k.startswith(dr):
-                                removekeys.append(k)
-                        for k in removekeys:
-                            del self.tree_cache[k]
-                        tp = check_type(path)
+                        self._forget(dr)
+                        tp = check_type(dr)
                         if tp:
                             if not info['follow_symlinks'] and tp[1]:
                                 continue  # symlinkを辿らない
                             elif tp[0] == 'file':
-                                if not match_pattern(path, info['file_exclude_patterns']):
-                                    print('[{}] will be indexed'.format(path))
-                                    items.append(path)
-                            continue
-                    for path in paths:
-                        basename = os.path.basename(path)
-                        # それぞれのエントリーをキャッシュから検索
-                        if path not in cache:
-                            cache[path] = check_type(path)
-                        tp = cache[path]
-                        if not tp:
-                            continue
-                        if not info['follow_symlinks'] and tp[1]:
-                            continue  # symlinkを辿らない
-                        if tp[0] == 'file':
-                            # includeがあるときはこっち優先
-                            if info['include_patterns']:
-                                if not match_pattern(basename, info['include_patterns']):
-                                    continue
-                            if not match_pattern(basename, info['file_exclude_patterns']):
-                                print('[{}] will be indexed'.format(path))
-                                items.append(path)
-                        elif tp[0] == 'dir':
-                            if not match_pattern(basename, info['folder_exclude_patterns']):
-                                newdrs.append(path)
+                                if not match_pattern(dr, info['file_exclude_patterns']):
+                                    print('[{}] will be indexed'.format(dr))
+                                    items.append(dr)
+                        continue
+                    elif isinstance(cache, FileNotFoundError):
+                        # 消えたディレクトリ
+                        self._forget(dr)
+                        continue
+                    files, subdirs = self._select(info, dr, cache)
+                    items.extend(files)
+                    newdrs.extend(subdirs)
                 drs = newdrs
-        self.item_cache = items
         return items
 
 
+class PathList(list):
+
+    '''DirectoryTree.pathsの結果。読み直さなかったディレクトリ数(skipped)と
+    読み直したディレクトリ数(rescanned)を持つ。
+    '''
+
+    skipped = 0
+    rescanned = 0
+
+
+class Manifest:
+
+    '''DirectoryTreeのキャッシュをプロジェクト毎のファイルに保存する。
+    ファイルはディレクトリ単位のレコードの列で、保存時には変更されたディレクトリの
+    レコードだけを追記する。同じディレクトリのレコードは後のものが優先される。
+    古いレコードが溜まったら生きているレコードだけで書き直す(compact)。
+
+    format: MAGIC, (長さ(uint32 little endian), JSON [dir, {name: type code}, mtime])*
+    type codeがnullのレコードは削除されたディレクトリを表す。
+    '''
+
+    MAGIC = b'SLMF1\n'
+    # 生きているレコード数に対してこれ以上溜まったらcompactする
+    COMPACT_RATIO = 2
+    COMPACT_MIN = 1024
+
+    def __init__(self, path):
+        self.path = path
+        # ファイル中のレコード数
+        self.records = 0
+
+    def load(self, tree):
+        '''ファイルからtreeのキャッシュを読み込む。ファイルがなければFalseを返す。'''
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(self.MAGIC):
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[:len(self.MAGIC)] != self.MAGIC:
+                    return False
+                cache = {}
+                mtimes = {}
+                records = 0
+                pos = len(self.MAGIC)
+                while pos + _RECORD_HEADER.size <= size:
+                    length, = _RECORD_HEADER.unpack_from(buf, pos)
+                    start = pos + _RECORD_HEADER.size
+                    if start + length > size:
+                        break  # 書き込み途中で終わったレコード
+                    record = json.loads(buf[start:start + length].decode('utf-8'))
+                    dr, entries = record[0], record[1]
+                    if entries is None:
+                        cache.pop(dr, None)
+                        mtimes.pop(dr, None)
+                    else:
+                        cache[dr] = dict((os.path.join(dr, name), _TYPES[code])
+                                         for name, code in entries.items())
+                        mtimes[dr] = record[2] if len(record) > 2 else None
+                    records += 1
+                    pos = start + length
+                if pos < size:
+                    # 壊れた末尾は次のsaveで書き直す
+                    records = float('inf')
+        tree.tree_cache = cache
+        tree.dir_mtimes = mtimes
+        tree.item_cache = None
+        tree.dirty.clear()
+        self.records = records
+        return True
+
+    def save(self, tree):
+        '''前回のsaveから変更されたディレクトリを追記する'''
+        live = len(tree.tree_cache)
+        if not os.path.exists(self.path) or \
+                self.records > max(self.COMPACT_MIN, live * self.COMPACT_RATIO):
+            self.compact(tree)
+            return
+        with open(self.path, 'ab') as f:
+            for dr in tree.dirty:
+                f.write(_encode_record(dr, tree.tree_cache.get(dr), tree.dir_mtimes.get(dr)))
+                self.records += 1
+        tree.dirty.clear()
+
+    def compact(self, tree):
+        '''生きているレコードだけでファイルを書き直す'''
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'wb') as f:
+            f.write(self.MAGIC)
+            for dr, cache in tree.tree_cache.items():
+                f.write(_encode_record(dr, cache, tree.dir_mtimes.get(dr)))
+        os.replace(tmppath, self.path)
+        self.records = len(tree.tree_cache)
+        tree.dirty.clear()
+
+
+_RECORD_HEADER = struct.Struct('<I')
+# check_typeの返り値とtype codeの対応
+_TYPES = [None, ('file', False), ('file', True), ('dir', False), ('dir', True)]
+
+
+def _encode_record(dr, cache, mtime=None):
+    if cache is None:
+        entries = None
+    else:
+        entries = dict((os.path.basename(path), _TYPES.index(tp))
+                       for path, tp in cache.items())
+    data = json.dumps([dr, entries, mtime], separators=(',', ':')).encode('utf-8')
+    return _RECORD_HEADER.pack(len(data)) + data
+
+
+def compile_patterns(patterns):
+    '''match_patternと同じ判定をする関数を返す。
+    パターン全てを一つの正規表現にまとめるので、エントリ毎のループがなくなる。
+    '''
+    if not patterns:
+        return _never
+    globs = []
+    suffixes = []
+    for pat in patterns:
+        rx = fnmatch.translate(os.path.normcase(pat))
+        if rx.endswith('(?ms)'):
+            rx = rx[:-len('(?ms)')]  # python < 3.6
+        globs.append('(?:{})'.format(rx))
+        suffixes.append('(?:.*{}\\Z)'.format(re.escape(pat)))
+    if os.path.normcase('A') == 'A':
+        return re.compile('|'.join(globs + suffixes), re.S).match
+    # fnmatchは大文字小文字を区別しないが、endswithは区別する(Windows)
+    glob = re.compile('|'.join(globs), re.S).match
+    suffix = re.compile('|'.join(suffixes), re.S).match
+    return lambda s: glob(os.path.normcase(s)) or suffix(s)
+
+
+def _never(s):
+    return None
+
+
 def match_pattern(s, patterns):
     for pat in patterns:
         if fnmatch.fnmatch(s, pat):
@@ -98,8 +363,47 @@ def match_pattern(s, patterns):
     return False
 
 
+def listdir_entries(dr, old):
+    '''os.listdirでディレクトリを読む。キャッシュにないエントリだけstatする。'''
+    cache = {}
+    for x in os.listdir(dr):
+        path = os.path.join(dr, x)
+        cache[path] = old[path] if path in old else check_type(path)
+    return cache
+
+
+def scandir_entries(dr, old):
+    '''os.scandirでディレクトリを読む。d_typeを使うので、symlink以外はstatしない。'''
+    cache = {}
+    for entry in os.scandir(dr):
+        path = entry.path
+        if path in old:
+            cache[path] = old[path]
+            continue
+        try:
+            # check_typeと同じくsymlinkの先を見る
+            if entry.is_file():
+                cache[path] = ('file', False)
+            elif entry.is_dir():
+                cache[path] = ('dir', False)
+            else:
+                cache[path] = None
+        except OSError:
+            cache[path] = None
+    return cache
+
+
+ENGINES = {
+    'listdir': listdir_entries,
+    'scandir': scandir_entries,
+}
+
+
 def check_type(path):
-    st = os.stat(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None  # broken symlinkなど
     islink = stat.S_ISLNK(st.st_mode)
     if stat.S_ISREG(st.st_mode):
         return ('file', islink)
@@ -0,0 +1,169 @@
+import os
+import sys
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+# inotify(7)の定数
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# ファイルの内容が変わったイベント
+CONTENT_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+# ディレクトリのエントリが変わったイベント
+ENTRY_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+SELF_EVENTS = IN_DELETE_SELF | IN_MOVE_SELF
+WATCH_MASK = CONTENT_EVENTS | ENTRY_EVENTS | SELF_EVENTS | IN_ONLYDIR
+
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+
+def is_supported():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class WatchLimitExceeded(Exception):
+    pass
+
+
+class InotifyWatcher:
+
+    '''inotifyでディレクトリを監視し、変更されたパスを集めるクラス。
+    ディレクトリは再帰的には監視されないので、監視したいディレクトリを全てwatchに渡す。
+    イベントがあふれたり、監視数の上限(fs.inotify.max_user_watches)に達した場合は
+    変更を取りこぼしているので、takeはNoneを返す(呼び出し側はtreeを全部走査する)。
+    '''
+
+    def __init__(self):
+        self.libc = _load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wds = {}  # wd -> directory
+        self.dirs = {}  # directory -> wd
+        self.lock = threading.Lock()
+        # 内容が変わったかもしれないパス
+        self.changed = set()
+        # エントリが変わったディレクトリ
+        self.changed_dirs = set()
+        # 取りこぼしがあった
+        self.overflowed = False
+        # 監視数の上限に達した
+        self.limit_exceeded = False
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, dirs):
+        '''まだ監視していないディレクトリを監視に加える'''
+        for dr in dirs:
+            if dr in self.dirs:
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dr), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    self.limit_exceeded = True
+                    raise WatchLimitExceeded(dr)
+                continue  # 消えたディレクトリなど
+            with self.lock:
+                self.wds[wd] = dr
+                self.dirs[dr] = wd
+
+    def take(self):
+        '''前回のtakeから変更されたパスを(changed, changed_dirs)で返す。
+        取りこぼしがあった場合はNoneを返す。
+        '''
+        with self.lock:
+            if self.overflowed or self.limit_exceeded:
+                result = None
+            else:
+                result = (self.changed, self.changed_dirs)
+            self.changed = set()
+            self.changed_dirs = set()
+            self.overflowed = False
+        return result
+
+    def healthy(self):
+        return self.running and not self.limit_exceeded
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.fd)
+
+    def _run(self):
+        while self.running:
+            readable, _, _ = select.select([self.fd], [], [], 1.0)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            with self.lock:
+                self._handle(data)
+
+    def _handle(self, data):
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, pos)
+            name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0')
+            pos += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            dr = self.wds.get(wd)
+            if dr is None:
+                continue
+            if mask & IN_IGNORED:
+                # 監視が外れた(ディレクトリが消えたなど)
+                del self.wds[wd]
+                self.dirs.pop(dr, None)
+                continue
+            if mask & SELF_EVENTS:
+                self.changed_dirs.add(os.path.dirname(dr))
+                continue
+            path = os.path.join(dr, os.fsdecode(name))
+            if mask & ENTRY_EVENTS:
+                self.changed_dirs.add(dr)
+                self.changed.add(path)
+            elif mask & CONTENT_EVENTS and not mask & IN_ISDIR:
+                self.changed.add(path)
@@ -0,0 +1,658 @@
+# Copyright 2007 Matt Chaput. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY MATT CHAPUT ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL MATT CHAPUT OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Matt Chaput.
+
+"""
+This module implements a "codec" which writes posting blocks in a binary
+layout instead of pickled tuples. Everything except the posting blocks (term
+index, per-document columns, vectors) is shared with the whoosh3 codec, and
+segments remember the codec they were written with, so segments of both
+codecs can be read and merged in one index.
+
+The IDs of each block, and the positions of fields with the
+:class:`whoosh.formats.Positions` format, are stored with whichever integer
+encoding is smallest for the block: packed ints, frame of reference
+bit-packing, Simple16, GInts or varints, optionally compressed. Encodings that
+are unpacked a whole block at a time are preferred, see :func:`encode_ints`.
+"""
+
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from whoosh import formats
+from whoosh.codec.whoosh3 import W3Codec, W3PostingsWriter, W3LeafMatcher
+from whoosh.compat import b, BytesIO, array_tobytes, array_frombytes, xrange
+from whoosh.filedb.structfile import BufferFile, StructFile
+from whoosh.matching import ReadTooFar
+from whoosh.util.numlists import delta_encode, delta_decode
+from whoosh.util.numlists import FrameOfReference, GInts, Simple16, Varints
+from whoosh.util.numeric import length_to_byte, byte_to_length
+from whoosh.util.varints import varint
+
+try:
+    from itertools import accumulate
+except ImportError:
+    accumulate = delta_decode
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+
+# This byte sequence is written at the start of a posting list to identify the
+# codec/version
+WHOOSH4_HEADER_MAGIC = b("W4Bl")
+# Posting lists of more than one block start with this sequence instead, and
+# end with a skip directory
+WHOOSH4_SKIPS_MAGIC = b("W4Sk")
+
+# Block header
+#
+# i | Length of the block data, negative for the last block
+# H | Number of postings in the block
+# I | Last ID in the block
+# f | Maximum weight in the block
+# B | Minimum length (encoded as byte)
+# B | Maximum length (encoded as byte)
+# B | Encoding of the IDs
+# B | Encoding of the weights
+# B | Encoding of the values
+# I | Byte length of the IDs
+# I | Byte length of the weights
+#
+# The block data follows the header: the IDs, the weights, then the values.
+_BLOCK = struct.Struct("<iHIfBBBBBII")
+_FLOAT = struct.Struct("<f")
+
+# Skip directory
+#
+# The skip directory follows the last block, so the matcher can find the
+# block containing an ID with a binary search and knows the maximum weight of
+# every block without reading their headers. It is made of four arrays with
+# an entry per block, followed by the number of blocks:
+#
+# I | Last ID in the block
+# I | Offset of the block header from the start of the posting list
+# f | Maximum weight in the block
+# B | Minimum length (encoded as byte)
+_SKIP_TYPECODES = ("I", "I", "f", "B")
+_SKIP_SIZE = 13
+_SKIPCOUNT = struct.Struct("<I")
+
+# Weight encodings
+WEIGHTS_ONE = 0  # All weights are 1.0, nothing is stored
+WEIGHTS_SAME = 1  # All weights are the same, stored once as a float
+WEIGHTS_ARRAY = 2  # An array of floats
+
+# Value encodings
+VALUES_NONE = 0  # The format has no values
+VALUES_FIXED = 1  # Values of the format's fixed size, concatenated
+VALUES_LENGTHS = 2  # The value lengths as packed ints, then the values
+VALUES_POSITIONS = 3  # The position counts and deltas as encoded ints
+# Flag added to the value encoding when the value bytes are compressed
+VALUES_COMPRESSED = 0x80
+
+# Packed unsigned ints are stored little endian in 1, 2 or 4 bytes each, so
+# they can be loaded into an array without decoding them one by one
+_TYPECODES = {1: "B", 2: "H", 4: "I"}
+_BIGENDIAN = sys.byteorder == "big"
+
+# Integer list encodings. The packed encodings are named by their itemsize
+# (1, 2 and 4). Packed ints and frame of reference are unpacked a block at a
+# time; the others are usually smaller but are decoded one number at a time
+INTS_FOR = 8
+INTS_SIMPLE16 = 16
+INTS_GINTS = 17
+INTS_VARINTS = 18
+_NUMLISTS = {INTS_FOR: FrameOfReference(), INTS_SIMPLE16: Simple16(),
+             INTS_GINTS: GInts(), INTS_VARINTS: Varints()}
+# The encodings decoded one number at a time are about a hundred times slower
+# to decode, so they are only used when they take at most half the bytes
+_SLOW_ENCODINGS = frozenset((INTS_SIMPLE16, INTS_GINTS, INTS_VARINTS))
+_SLOW_COST = 2
+# Flag added to a packed or frame of reference encoding when the encoded bytes
+# are compressed, which only pays off for longer lists
+INTS_COMPRESSED = 0x80
+_COMPRESS_MIN = 64
+
+# The encodings the writer chooses from by default
+DEFAULT_ENCODINGS = (INTS_FOR, INTS_SIMPLE16, INTS_GINTS, INTS_VARINTS)
+
+# Positions header: the encoding of the counts, the encoding of the deltas,
+# and the byte length of the counts
+_POSITIONS = struct.Struct("<BBI")
+
+
+def pack_uints(nums):
+    """Returns the itemsize and the bytes of the given unsigned ints packed in
+    the smallest of 1, 2 or 4 bytes.
+    """
+
+    arry = array("I", nums)
+    top = max(arry) if arry else 0
+    if top < 0x100:
+        size = 1
+    elif top < 0x10000:
+        size = 2
+    else:
+        size = 4
+    if size != arry.itemsize:
+        arry = array(_TYPECODES[size], arry)
+    if _BIGENDIAN:
+        arry.byteswap()
+    return size, array_tobytes(arry)
+
+
+def unpack_uints(size, bs):
+    """Returns an array of the unsigned ints packed by :func:`pack_uints`.
+    """
+
+    arry = array(_TYPECODES[size])
+    array_frombytes(arry, bs)
+    if _BIGENDIAN:
+        arry.byteswap()
+    return arry
+
+
+def encoded_sizes(nums, encodings=DEFAULT_ENCODINGS):
+    """Returns a list of ``(size, encoding)`` pairs, in the order of the
+    given encodings after the packed ints, with the number of bytes each
+    encoding takes for the given unsigned ints. The sizes are worked out from
+    the bit widths of the numbers, without encoding them, except the size of
+    Simple16 which is only a lower bound.
+    """
+
+    top = max(nums) if nums else 0
+    if top < 0x100:
+        size = 1
+    elif top < 0x10000:
+        size = 2
+    else:
+        size = 4
+    widths = [n.bit_length() or 1 for n in nums]
+
+    sizes = [(len(nums) * size, size)]
+    for code in encodings:
+        if code == INTS_FOR:
+            base = min(nums) if nums else 0
+            width = FrameOfReference.width(top - base)
+            size = len(varint(base)) + 1 + (len(nums) * width + 7) // 8
+        elif code == INTS_GINTS:
+            size = (len(nums) + 3) // 4 + sum((w + 7) // 8 for w in widths)
+        elif code == INTS_VARINTS:
+            size = sum((w + 6) // 7 for w in widths)
+        elif code == INTS_SIMPLE16:
+            if top > Simple16.maxint:
+                continue
+            size = (sum(widths) + 27) // 28 * 4
+        else:
+            raise ValueError("Unknown integer encoding %r" % code)
+        sizes.append((size, code))
+    return sizes
+
+
+def _cost(code, size):
+    return size * _SLOW_COST if code in _SLOW_ENCODINGS else size
+
+
+def encode_ints(nums, encodings=DEFAULT_ENCODINGS, compression=0):
+    """Returns the encoding and the bytes of the given unsigned ints, in
+    whichever of packed ints and the given encodings takes the fewest bytes.
+    The encodings that decode one number at a time must take at most half
+    the bytes of the others to be used, and ties go to the encoding listed
+    first.
+
+    :param compression: if not 0, the zlib compression level at which to
+        also try compressing the packed or frame of reference bytes.
+    """
+
+    best = bestcost = None
+    for size, code in encoded_sizes(nums, encodings):
+        if best is not None and _cost(code, size) >= bestcost:
+            continue
+        if code in _TYPECODES:
+            bs = pack_uints(nums)[1]
+        else:
+            f = StructFile(BytesIO())
+            _NUMLISTS[code].write_nums(f, nums)
+            bs = f.file.getvalue()
+        # The Simple16 size is only a lower bound
+        if best is None or _cost(code, len(bs)) < bestcost:
+            best, bestcost = (code, bs), _cost(code, len(bs))
+
+        if (compression and zlib and code not in _SLOW_ENCODINGS
+                and len(bs) >= _COMPRESS_MIN):
+            zbs = zlib.compress(bs, compression)
+            if len(zbs) < bestcost:
+                best, bestcost = (code | INTS_COMPRESSED, zbs), len(zbs)
+    return best
+
+
+def decode_ints(code, bs, n):
+    """Returns an array of the ``n`` unsigned ints encoded by
+    :func:`encode_ints`.
+    """
+
+    if code & INTS_COMPRESSED:
+        code &= ~INTS_COMPRESSED
+        bs = zlib.decompress(bs)
+    if code in _TYPECODES:
+        return unpack_uints(code, bs)
+    return array("I", _NUMLISTS[code].read_nums(BufferFile(bytes(bs)), n))
+
+
+def _float_array(bs):
+    arry = array("f")
+    array_frombytes(arry, bs)
+    if _BIGENDIAN:
+        arry.byteswap()
+    return arry
+
+
+class W4Codec(W3Codec):
+    def __init__(self, blocklimit=128, compression=3, inlinelimit=1,
+                 encodings=DEFAULT_ENCODINGS):
+        """
+        :param encodings: the integer encodings the postings writer may use
+            for IDs and positions in addition to packed ints, see
+            :func:`encode_ints`. Pass an empty sequence to only use packed
+            ints, which are the fastest to decode.
+        """
+
+        W3Codec.__init__(self, blocklimit=blocklimit,
+                         compression=compression, inlinelimit=inlinelimit)
+        self._encodings = tuple(encodings)
+
+    def postings_writer(self, dbfile, byteids=False):
+        if byteids:
+            # Vector postings are read by W3PerDocReader, which expects the
+            # whoosh3 block format
+            return W3Codec.postings_writer(self, dbfile, byteids=byteids)
+        return W4PostingsWriter(dbfile, blocklimit=self._blocklimit,
+                                compression=self._compression,
+                                inlinelimit=self._inlinelimit,
+                                encodings=self._encodings)
+
+    def postings_reader(self, dbfile, terminfo, format_, term=None, scorer=None):
+        if terminfo.is_inlined():
+            return W3Codec.postings_reader(self, dbfile, terminfo, format_,
+                                           term=term, scorer=scorer)
+        offset, length = terminfo.extent()
+        return W4LeafMatcher(dbfile, offset, length, format_, term=term,
+                             scorer=scorer)
+
+
+# Postings
+
+class W4PostingsWriter(W3PostingsWriter):
+    """Writes posting blocks as a binary header followed by encoded IDs,
+    weights and values. The block statistics and term info are the same as
+    in :class:`whoosh.codec.whoosh3.W3PostingsWriter`.
+    """
+
+    def __init__(self, postfile, blocklimit, compression=3, inlinelimit=1,
+                 encodings=DEFAULT_ENCODINGS):
+        # The block length is stored in a short
+        W3PostingsWriter.__init__(self, postfile, min(blocklimit, 0xffff),
+                                  compression=compression,
+                                  inlinelimit=inlinelimit)
+        self._encodings = encodings
+
+    def start_postings(self, format_, terminfo):
+        W3PostingsWriter.start_postings(self, format_, terminfo)
+        # Skip directory entries of the blocks written so far
+        self._skips = []
+
+    def _write_block(self, last=False):
+        # Write the buffered block to the postings file
+        postfile = self._postfile
+
+        # If this is the first block, write a small header first. A posting
+        # list with a single block doesn't need a skip directory
+        if not self._blockcount:
+            postfile.write(WHOOSH4_HEADER_MAGIC if last
+                           else WHOOSH4_SKIPS_MAGIC)
+
+        # Add this block's statistics to the terminfo object
+        self._terminfo.add_block(self)
+
+        ids = self._ids
+        idcode, idbytes = encode_ints(list(delta_encode(ids)),
+                                      self._encodings, self._compression)
+        weightcode, weightbytes = self._pack_weights()
+        valuecode, valuebytes = self._pack_values()
+
+        length = len(idbytes) + len(weightbytes) + len(valuebytes)
+        if last:
+            # If this is the last block, use a negative number
+            length *= -1
+        header = _BLOCK.pack(length, len(ids), ids[-1], self._maxweight,
+                             length_to_byte(self._minlength),
+                             length_to_byte(self._maxlength),
+                             idcode, weightcode, valuecode,
+                             len(idbytes), len(weightbytes))
+
+        self._skips.append((ids[-1], postfile.tell() - self._startoffset,
+                            self._maxweight, length_to_byte(self._minlength)))
+        postfile.write(header)
+        postfile.write(idbytes)
+        postfile.write(weightbytes)
+        postfile.write(valuebytes)
+        if last and self._blockcount:
+            self._write_skips()
+
+        self._blockcount += 1
+        # Reset block buffer
+        self._new_block()
+
+    def _write_skips(self):
+        # Write the skip directory after the last block
+        postfile = self._postfile
+        for typecode, column in zip(_SKIP_TYPECODES, zip(*self._skips)):
+            arry = array(typecode, column)
+            if _BIGENDIAN:
+                arry.byteswap()
+            postfile.write(array_tobytes(arry))
+        postfile.write(_SKIPCOUNT.pack(len(self._skips)))
+
+    def _pack_weights(self):
+        weights = self._weights
+        first = weights[0]
+        if all(w == first for w in weights):
+            if first == 1.0:
+                return WEIGHTS_ONE, b("")
+            return WEIGHTS_SAME, _FLOAT.pack(first)
+        if _BIGENDIAN:
+            weights = array("f", weights)
+            weights.byteswap()
+        return WEIGHTS_ARRAY, array_tobytes(weights)
+
+    def _pack_values(self):
+        fixedsize = self._format.fixed_value_size()
+        values = self._values
+
+        if fixedsize == 0 or not values:
+            return VALUES_NONE, b("")
+        elif type(self._format) is formats.Positions:
+            return VALUES_POSITIONS, self._pack_positions()
+        elif fixedsize is None or fixedsize < 0:
+            size, lengths = pack_uints([len(v) for v in values])
+            code = VALUES_LENGTHS
+            bs = b("").join(values)
+        else:
+            size, lengths = 0, b("")
+            code = VALUES_FIXED
+            bs = b("").join(values)
+
+        # If the values are less than 20 bytes, don't bother compressing
+        if self._compression and zlib and len(bs) >= 20:
+            bs = zlib.compress(bs, self._compression)
+            code |= VALUES_COMPRESSED
+        if code & ~VALUES_COMPRESSED == VALUES_LENGTHS:
+            # The itemsize of the lengths, the lengths, then the values
+            bs = struct.pack("B", size) + lengths + bs
+        return code, bs
+
+
+    def _pack_positions(self):
+        # Store the number of positions of each posting, then the deltas
+        # between the positions of each posting
+        decode_positions = self._format.decode_positions
+        counts = []
+        deltas = []
+        for v in self._values:
+            poslist = decode_positions(v)
+            counts.append(len(poslist))
+            deltas.extend(delta_encode(poslist))
+
+        countcode, countbytes = encode_ints(counts, self._encodings,
+                                            self._compression)
+        deltacode, deltabytes = encode_ints(deltas, self._encodings,
+                                            self._compression)
+        return (_POSITIONS.pack(countcode, deltacode, len(countbytes))
+                + countbytes + deltabytes)
+
+
+class W4LeafMatcher(W3LeafMatcher):
+    """Reads posting blocks written by :class:`W4PostingsWriter`. The block
+    header is read with a single struct unpack, and packed IDs and weights
+    are loaded straight into arrays. Positions stored as integers are
+    returned by :meth:`value_as` without unpickling them.
+
+    :meth:`skip_to` finds the block containing the target ID with a binary
+    search of the skip directory instead of reading the headers of the
+    blocks in between, and :meth:`shallow_skip_to` moves to that block
+    without reading its IDs, so that :meth:`block_quality` can be checked
+    before deciding to look at the postings.
+    """
+
+    def __init__(self, postfile, startoffset, length, format_, term=None,
+                 scorer=None):
+        W3LeafMatcher.__init__(self, postfile, startoffset, length, format_,
+                               term=term, scorer=scorer)
+
+    def _read_header(self):
+        # Seek to the start of the postings and check the header tag
+        postfile = self._postfile
+
+        postfile.seek(self._startoffset)
+        magic = postfile.read(4)
+        if magic not in (WHOOSH4_HEADER_MAGIC, WHOOSH4_SKIPS_MAGIC):
+            raise Exception("Block tag error %r" % magic)
+        # The skip directory is loaded the first time it's needed
+        self._hasskips = magic == WHOOSH4_SKIPS_MAGIC
+        self._skips = None
+
+        # Remember the base offset (start of postings, after the header)
+        self._baseoffset = postfile.tell()
+
+    def _goto(self, position):
+        # Read the header of the posting block at the given position
+
+        # Reset block data -- we'll lazy load the data from the new block as
+        # needed
+        self._data = None
+        self._ids = None
+        self._weights = None
+        self._values = None
+        # Reset pointer into the block
+        self._i = 0
+
+        header = self._postfile.get(position, _BLOCK.size)
+        (length, self._blocklength, self._maxid, self._maxweight, mnlen, mxlen,
+         self._idcode, self._weightcode, self._valuecode, self._idlength,
+         self._weightlength) = _BLOCK.unpack(header)
+        # If the block length is negative, that means this is the last block
+        if length < 0:
+            self._lastblock = True
+            length *= -1
+
+        self._dataoffset = position + _BLOCK.size
+        # Remember the offset of the next block
+        self._nextoffset = self._dataoffset + length
+        self._minlength = byte_to_length(mnlen)
+        self._maxlength = byte_to_length(mxlen)
+
+    def _read_skips(self):
+        # Load the skip directory from the end of the posting list
+        end = self._startoffset + self._length - _SKIPCOUNT.size
+        count = _SKIPCOUNT.unpack(self._postfile.get(end, _SKIPCOUNT.size))[0]
+        bs = self._postfile.get(end - count * _SKIP_SIZE, count * _SKIP_SIZE)
+
+        skips = []
+        start = 0
+        for typecode in _SKIP_TYPECODES:
+            arry = array(typecode)
+            size = arry.itemsize * count
+            array_frombytes(arry, bs[start:start + size])
+            if _BIGENDIAN:
+                arry.byteswap()
+            skips.append(arry)
+            start += size
+        self._skips = skips
+
+    def _skip_blocks(self, targetid):
+        # Move to the block that contains the target ID, or would contain it,
+        # if it's after the current block. Returns False if the target is
+        # after the last block.
+
+        if targetid <= self._maxid:
+            return True
+        if not self._hasskips:
+            self._skip_to_block(lambda: targetid > self._maxid)
+            return self.is_active()
+
+        if self._skips is None:
+            self._read_skips()
+        lastids, offsets = self._skips[:2]
+        n = bisect_left(lastids, targetid)
+        if n == len(lastids):
+            self._atend = True
+            return False
+        self._goto(self._startoffset + offsets[n])
+        return True
+
+    def skip_to(self, targetid):
+        # Skip to the next ID equal to or greater than the given target ID
+
+        if not self.is_active():
+            raise ReadTooFar
+        if not self._skip_blocks(targetid):
+            return
+
+        # Find the target in the block
+        if self._ids is None:
+            self._read_ids()
+        self._i = bisect_left(self._ids, targetid, self._i)
+
+    def supports_shallow_skip(self):
+        return True
+
+    def shallow_skip_to(self, targetid):
+        if not self.is_active():
+            raise ReadTooFar
+        return self._skip_blocks(targetid)
+
+    def _read_data(self):
+        # Load the block data from disk
+        datalen = self._nextoffset - self._dataoffset
+        self._data = memoryview(self._postfile.get(self._dataoffset, datalen))
+
+    def _read_ids(self):
+        # If we haven't loaded the data from disk yet, load it now
+        if self._data is None:
+            self._read_data()
+        deltas = decode_ints(self._idcode, self._data[:self._idlength],
+                             self._blocklength)
+        self._ids = array("I", accumulate(deltas))
+
+    def _read_weights(self):
+        code = self._weightcode
+        postcount = self._blocklength
+        if code == WEIGHTS_ONE:
+            self._weights = array("f", (1.0,)) * postcount
+            return
+
+        # If we haven't loaded the data from disk yet, load it now
+        if self._data is None:
+            self._read_data()
+        start = self._idlength
+        bs = self._data[start:start + self._weightlength]
+        if code == WEIGHTS_SAME:
+            self._weights = array("f", _FLOAT.unpack(bs)) * postcount
+        else:
+            self._weights = _float_array(bs)
+
+    def _read_values(self):
+        code = self._valuecode
+        postcount = self._blocklength
+        if code == VALUES_NONE:
+            self._values = (None,) * postcount
+            return
+
+        # If we haven't loaded the data from disk yet, load it now
+        if self._data is None:
+            self._read_data()
+        bs = self._data[self._idlength + self._weightlength:]
+
+        if code == VALUES_POSITIONS:
+            self._values = self._read_positions(bs, postcount)
+            return
+
+        lengths = None
+        if code & ~VALUES_COMPRESSED == VALUES_LENGTHS:
+            size = bs[0] if isinstance(bs[0], int) else ord(bs[0])
+            end = 1 + size * postcount
+            lengths = unpack_uints(size, bs[1:end])
+            bs = bs[end:]
+
+        if code & VALUES_COMPRESSED:
+            bs = zlib.decompress(bs)
+        else:
+            bs = bs.tobytes()
+
+        if lengths is None:
+            fixedsize = self._fixedsize
+            self._values = [bs[i:i + fixedsize]
+                            for i in xrange(0, len(bs), fixedsize)]
+        else:
+            self._values = [bs[end - length:end] for end, length
+                            in zip(accumulate(lengths), lengths)]
+
+    def _read_positions(self, bs, postcount):
+        # Returns a list of the positions of each posting in the block
+        countcode, deltacode, countlength = _POSITIONS.unpack(
+            bs[:_POSITIONS.size])
+        start = _POSITIONS.size
+        counts = decode_ints(countcode, bs[start:start + countlength],
+                             postcount)
+        deltas = decode_ints(deltacode, bs[start + countlength:], sum(counts))
+        return [list(accumulate(deltas[end - count:end])) for end, count
+                in zip(accumulate(counts), counts)]
+
+    def value(self):
+        if self._valuecode == VALUES_POSITIONS:
+            # Encode the positions the way the format does, for code that
+            # reads the raw values (e.g. merging segments)
+            return self.format.encode(self.value_as("positions"))
+        return W3LeafMatcher.value(self)
+
+    def value_as(self, astype):
+        if self._valuecode == VALUES_POSITIONS:
+            if self._values is None:
+                self._read_values()
+            poslist = self._values[self._i]
+            if astype == "positions":
+                return poslist
+            elif astype == "frequency":
+                return len(poslist)
+            elif astype == "position_boosts":
+                return [(pos, 1) for pos in poslist]
+            return self.format.decoder(astype)(self.value())
+        return W3LeafMatcher.value_as(self, astype)
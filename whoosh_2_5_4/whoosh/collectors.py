@@ -85,7 +85,7 @@ from heapq import heapify, heappush, heapreplace
 
 from whoosh import sorting
 from whoosh.compat import abstractmethod, iteritems, itervalues, xrange
-from whoosh.searching import Results, TimeLimit
+from whoosh.searching import Results, TimeLimit, SearchCancelled
 from whoosh.util import now
 
 
@@ -437,6 +437,12 @@ class TopCollector(ScoredCollector):
         self.usequality = usequality
         self.total = 0
 
+    def prepare(self, top_searcher, q, context):
+        # Tell the queries how many documents are wanted, so they can skip the
+        # documents that can't make the top N
+        ScoredCollector.prepare(self, top_searcher, q,
+                                context.set(limit=self.limit))
+
     def _use_block_quality(self):
         return (self.usequality
                 and not self.top_searcher.weighting.use_final
@@ -1078,6 +1084,57 @@ class TimeLimitCollector(WrappingCollector):
         self.child.finish()
 
 
+# Cancellable collector
+
+class CancelCollector(WrappingCollector):
+    """A collector that raises a :class:`whoosh.searching.SearchCancelled`
+    exception when a cancellation token is set, for example when a newer
+    search replaces this one::
+
+        token = threading.Event()
+        cc = CancelCollector(collectors.UnlimitedCollector(), token)
+        # In another thread: token.set()
+        try:
+            mysearcher.search_with_collector(myquery, cc)
+        except searching.SearchCancelled:
+            print("The search was cancelled!")
+
+    Unlike :class:`TimeLimitCollector`, this collector does not use signals,
+    so it works in any thread. The token is checked before each found
+    document, so a slow matcher can still run for a while between checks.
+    """
+
+    def __init__(self, child, token):
+        """
+        :param child: the collector to wrap.
+        :param token: an object with an ``is_set()`` method, such as a
+            ``threading.Event``. The search is cancelled once it returns
+            ``True``.
+        """
+
+        self.child = child
+        self.token = token
+
+    def prepare(self, top_searcher, q, context):
+        if self.token.is_set():
+            raise SearchCancelled
+        self.child.prepare(top_searcher, q, context)
+
+    def set_subsearcher(self, subsearcher, offset):
+        if self.token.is_set():
+            raise SearchCancelled
+        WrappingCollector.set_subsearcher(self, subsearcher, offset)
+
+    def collect_matches(self):
+        child = self.child
+        is_set = self.token.is_set
+
+        for sub_docnum in child.matches():
+            if is_set():
+                raise SearchCancelled
+            child.collect(sub_docnum)
+
+
 # Matched terms collector
 
 class TermsCollector(WrappingCollector):
@@ -505,19 +505,23 @@ class FileIndex(Index):
                 return EmptyReader(schema)
 
             if reuse:
-                # Put all atomic readers in a dictionary keyed by their
-                # generation, so we can re-use them if them if possible
+                # Put all segment readers in a dictionary keyed by their
+                # segment ID, so we can re-use them if possible
                 readers = [r for r, _ in reuse.leaf_readers()]
-                reusable = dict((r.generation(), r) for r in readers)
+                reusable = dict((r.segment().segment_id(), r) for r in readers
+                                if isinstance(r, SegmentReader))
 
             # Make a function to open readers, which reuses reusable readers.
             # It removes any readers it reuses from the "reusable" dictionary,
             # so later we can close any readers left in the dictionary.
             def segreader(segment):
                 segid = segment.segment_id()
-                if segid in reusable:
-                    r = reusable[segid]
+                # A segment with new deletions needs a new reader
+                r = reusable.get(segid)
+                if r and r.segment().deleted_count() == segment.deleted_count():
                     del reusable[segid]
+                    # The reader now belongs to the new generation
+                    r._gen = generation
                     return r
                 else:
                     return SegmentReader(storage, schema, segment,
@@ -310,3 +310,345 @@ class ArrayUnionMatcher(CombinationMatcher):
 
     def score(self):
         return self._a[self._docnum - self._offset]
+
+
+class WandUnionMatcher(CombinationMatcher):
+    """Matches the union (OR) of the sub-matchers for searches that only keep
+    the top N scored documents, without scoring every matching document.
+
+    The collector passes the lowest score in its top N to :meth:`replace` or
+    :meth:`skip_to_quality`. The sub-matchers are kept sorted by their
+    current document, and the matcher skips to the first document where the
+    maximum qualities of the sub-matchers up to it add up to more than that
+    score (WAND). Sub-matchers that support
+    :meth:`~whoosh.matching.Matcher.shallow_skip_to` then give the maximum
+    quality of the block containing the document instead, and the documents
+    up to the end of the blocks are skipped when those don't add up either
+    (Block-Max WAND).
+
+    Until the collector reports a minimum score, every matching document is
+    returned, like a tree of :class:`~whoosh.matching.binary.UnionMatcher`
+    objects. The sub-matchers must support block quality.
+    """
+
+    def __init__(self, submatchers, boost=1.0):
+        CombinationMatcher.__init__(self, submatchers, boost=boost)
+        self._minquality = 0
+        # Number of documents whose score was computed (for debugging)
+        self.scored_count = 0
+        self._setup()
+
+    def __repr__(self):
+        return "%s(%r, boost=%f)" % (self.__class__.__name__,
+                                     self._submatchers, self._boost)
+
+    def _setup(self):
+        # Pairs of (sub-matcher, maximum quality) for the active sub-matchers
+        self._cursors = [(m, m.max_quality()) for m in self._submatchers
+                         if m.is_active()]
+        self._id = None
+        self._score = None
+        self._find_next()
+
+    def _find_next(self):
+        boost = self._boost
+
+        while True:
+            cursors = self._cursors = [c for c in self._cursors
+                                       if c[0].is_active()]
+            if not cursors:
+                self._id = None
+                return
+            cursors.sort(key=lambda c: c[0].id())
+            minquality = self._minquality
+
+            # Find the pivot: the first sub-matcher at which the maximum
+            # qualities add up to more than the minimum. The documents before
+            # its current document can't beat the minimum.
+            pivot = 0
+            if minquality:
+                total = 0
+                for pivot, (_, maxquality) in enumerate(cursors):
+                    total += maxquality
+                    if total * boost > minquality:
+                        break
+                else:
+                    self._cursors = []
+                    self._id = None
+                    return
+            pivotid = cursors[pivot][0].id()
+            last = pivot
+            while last + 1 < len(cursors) and cursors[last + 1][0].id() == pivotid:
+                last += 1
+
+            if minquality and not self._block_bound(cursors, last, pivotid):
+                continue
+
+            # Move the sub-matchers before the pivot to its document and
+            # score it
+            for m, _ in cursors[:pivot]:
+                if m.is_active() and m.id() < pivotid:
+                    m.skip_to(pivotid)
+            score = 0
+            for m, _ in cursors[:last + 1]:
+                if m.is_active() and m.id() == pivotid:
+                    score += m.score()
+            score *= boost
+            self.scored_count += 1
+
+            if not minquality or score > minquality:
+                self._id = pivotid
+                self._score = score
+                return
+            for m, _ in cursors[:last + 1]:
+                if m.is_active() and m.id() == pivotid:
+                    m.next()
+
+    def _block_bound(self, cursors, last, pivotid):
+        # Checks the maximum qualities of the blocks containing the pivot
+        # document. If they don't add up to more than the minimum, skips the
+        # sub-matchers up to the pivot past the end of the shortest block and
+        # returns False.
+
+        bound = 0
+        blockend = None
+        for m, maxquality in cursors[:last + 1]:
+            if not m.supports_shallow_skip():
+                bound += maxquality
+            elif m.shallow_skip_to(pivotid):
+                bound += m.block_quality()
+                maxid = m.block_max_id()
+                if blockend is None or maxid < blockend:
+                    blockend = maxid
+        if bound * self._boost > self._minquality:
+            return True
+
+        # No document from the pivot to the end of the blocks can beat the
+        # minimum, and the other sub-matchers are past that
+        target = pivotid + 1 if blockend is None else blockend + 1
+        if last + 1 < len(cursors):
+            target = min(target, cursors[last + 1][0].id())
+        target = max(target, pivotid + 1)
+        for m, _ in cursors[:last + 1]:
+            if m.is_active() and m.id() < target:
+                m.skip_to(target)
+        return False
+
+    def _set_minquality(self, minquality):
+        self._minquality = minquality or 0
+
+    def is_active(self):
+        return self._id is not None
+
+    def id(self):
+        return self._id
+
+    def score(self):
+        return self._score
+
+    def supports(self, astype):
+        # This matcher doesn't support any posting values
+        return False
+
+    def max_quality(self):
+        return sum(q for m, q in self._cursors if m.is_active()) * self._boost
+
+    def block_quality(self):
+        return self.max_quality()
+
+    def replace(self, minquality=0):
+        self._set_minquality(minquality)
+        cursors = [c for c in self._cursors if c[0].is_active()]
+        if not cursors or not self.is_active():
+            return mcore.NullMatcher()
+        elif len(cursors) == 1 and self._boost == 1.0:
+            # The only active sub-matcher is on the current document
+            return cursors[0][0].replace(minquality)
+        elif minquality and self.max_quality() <= minquality:
+            # No remaining document can beat the minimum
+            return mcore.NullMatcher()
+        return self
+
+    def reset(self):
+        for m in self._submatchers:
+            m.reset()
+        self._minquality = 0
+        self._setup()
+
+    def copy(self):
+        return self.__class__([m.copy() for m in self._submatchers],
+                              boost=self._boost)
+
+    def next(self):
+        if not self.is_active():
+            raise mcore.ReadTooFar
+        docid = self._id
+        for m, _ in self._cursors:
+            if m.is_active() and m.id() == docid:
+                m.next()
+        self._find_next()
+        return False
+
+    def skip_to(self, docid):
+        if not self.is_active():
+            raise mcore.ReadTooFar
+        if docid <= self._id:
+            return
+        for m, _ in self._cursors:
+            if m.is_active() and m.id() < docid:
+                m.skip_to(docid)
+        self._find_next()
+
+    def skip_to_quality(self, minquality):
+        self._set_minquality(minquality)
+        if self.is_active() and minquality and self._score <= minquality:
+            self.next()
+            return 1
+        return 0
+
+
+class PhraseMatcher(CombinationMatcher):
+    """Matches the documents where the terms of the sub-matchers appear one
+    after another, in order, as in an exact phrase.
+
+    The sub-matchers are moved to the documents containing all the terms,
+    starting from the rarest term, and only then are the positions of the
+    terms compared: each term's position list is shifted by its offset in the
+    phrase and intersected with the start positions found so far, without
+    creating :class:`~whoosh.query.spans.Span` objects. The sub-matchers must
+    be term matchers supporting positions.
+    """
+
+    def __init__(self, submatchers, boost=1.0, order=None):
+        """
+        :param submatchers: a list of term matchers, in the order of the words
+            in the phrase.
+        :param boost: a factor to multiply the scores by.
+        :param order: the indexes of the sub-matchers in the order they should
+            be read, ideally from the rarest term to the most common one. The
+            default is the order of the phrase.
+        """
+
+        CombinationMatcher.__init__(self, submatchers, boost=boost)
+        if order is None:
+            order = xrange(len(submatchers))
+        self._order = list(order)
+        self._id = None
+        # The set of positions of one of the words, and its index in the phrase
+        self._starts = None
+        self._find_next()
+
+    def __repr__(self):
+        return "%s(%r, boost=%f)" % (self.__class__.__name__,
+                                     self._submatchers, self._boost)
+
+    def _find_next(self, target=0):
+        ms = self._submatchers
+        lead = ms[self._order[0]]
+        others = [ms[i] for i in self._order[1:]]
+
+        while lead.is_active():
+            if lead.id() < target:
+                lead.skip_to(target)
+                continue
+
+            # Move the other sub-matchers to the lead's document, or start over
+            # from the first document past it
+            docid = lead.id()
+            for m in others:
+                if m.is_active() and m.id() < docid:
+                    m.skip_to(docid)
+                if not m.is_active():
+                    self._id = None
+                    return
+                if m.id() > docid:
+                    target = m.id()
+                    break
+            else:
+                if self._find_starts():
+                    self._id = docid
+                    return
+                target = docid + 1
+        self._id = None
+
+    def _find_starts(self):
+        # Intersects the positions of the words in the current document, each
+        # shifted by its distance to the previous word read. Returns False if
+        # the words never appear one after another.
+
+        ms = self._submatchers
+        positions = None
+        last = 0
+        for i in self._order:
+            wordpositions = ms[i].value_as("positions")
+            if positions is None:
+                positions = set(wordpositions)
+            else:
+                positions = set(wordpositions).intersection(
+                    map((i - last).__add__, positions))
+            last = i
+            if not positions:
+                return False
+        self._starts = (positions, last)
+        return True
+
+    def is_active(self):
+        return self._id is not None
+
+    def id(self):
+        return self._id
+
+    def supports(self, astype):
+        # This matcher doesn't support any posting values
+        return False
+
+    def spans(self):
+        from whoosh.query.spans import Span
+
+        positions, offset = self._starts
+        length = len(self._submatchers)
+        return [Span(pos - offset, pos - offset + length - 1)
+                for pos in sorted(positions)]
+
+    def max_quality(self):
+        return sum(m.max_quality() for m in self._submatchers) * self._boost
+
+    def block_quality(self):
+        return sum(m.block_quality() for m in self._submatchers) * self._boost
+
+    def replace(self, minquality=0):
+        if not self.is_active():
+            return mcore.NullMatcher()
+        if minquality and self.max_quality() <= minquality:
+            return mcore.NullMatcher()
+        return self
+
+    def reset(self):
+        for m in self._submatchers:
+            m.reset()
+        self._find_next()
+
+    def copy(self):
+        return self.__class__([m.copy() for m in self._submatchers],
+                              boost=self._boost, order=self._order)
+
+    def next(self):
+        if not self.is_active():
+            raise mcore.ReadTooFar
+        self._find_next(self._id + 1)
+
+    def skip_to(self, docid):
+        if not self.is_active():
+            raise mcore.ReadTooFar
+        if docid > self._id:
+            self._find_next(docid)
+
+    def skip_to_quality(self, minquality):
+        skipped = 0
+        while self.is_active() and self.block_quality() <= minquality:
+            # No document up to the end of the first block to end can score
+            # more than the minimum
+            target = min(m.block_max_id() for m in self._submatchers) + 1
+            self._find_next(target)
+            skipped += 1
+        return skipped
@@ -305,6 +305,22 @@ class Matcher(object):
 
         raise NotImplementedError(self.__class__.__name__)
 
+    def supports_shallow_skip(self):
+        """Returns True if this matcher supports :meth:`shallow_skip_to`.
+        """
+
+        return False
+
+    def shallow_skip_to(self, id):
+        """Moves this matcher to the block of postings that would contain the
+        given ID, without reading the postings, so that ``block_quality`` and
+        ``block_max_id`` describe that block. The matcher must be moved with
+        :meth:`skip_to` before reading the current posting. Returns False if
+        there are no more blocks.
+        """
+
+        raise NotImplementedError(self.__class__.__name__)
+
     @abstractmethod
     def next(self):
         """Moves this matcher to the next posting.
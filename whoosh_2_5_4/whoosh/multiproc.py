@@ -31,7 +31,7 @@ from multiprocessing import Process, Queue, cpu_count
 
 from whoosh.compat import xrange, iteritems, pickle
 from whoosh.codec import base
-from whoosh.writing import PostingPool, SegmentWriter
+from whoosh.writing import PostingPool, SegmentWriter, add_stats, timing
 from whoosh.externalsort import imerge
 from whoosh.util import random_name
 
@@ -63,7 +63,7 @@ class SubWriterTask(Process):
     # them, and when it's done, puts a summary of its work on a results Queue
 
     def __init__(self, storage, indexname, jobqueue, resultqueue, kwargs,
-                 multisegment):
+                 multisegment, docfilter=None):
         Process.__init__(self)
         self.storage = storage
         self.indexname = indexname
@@ -71,6 +71,7 @@ class SubWriterTask(Process):
         self.resultqueue = resultqueue
         self.kwargs = kwargs
         self.multisegment = multisegment
+        self.docfilter = docfilter
         self.running = True
 
     def run(self):
@@ -127,9 +128,10 @@ class SubWriterTask(Process):
                 k = self.kwargs.get("k", 64)
                 runname, fieldnames, segment = finish_subsegment(writer, k)
 
-            # Put the results (the run filename and the segment object) on the
-            # result queue
-            resultqueue.put((runname, fieldnames, segment), timeout=5)
+            # Put the results (the run filename, the segment object and the
+            # indexing statistics) on the result queue
+            stats = writer.indexing_stats()
+            resultqueue.put((runname, fieldnames, segment, stats), timeout=5)
 
     def _process_file(self, filename, doc_count):
         # This method processes a "job file" written out by the parent task. A
@@ -138,6 +140,7 @@ class SubWriterTask(Process):
 
         writer = self.writer
         tempstorage = writer.temp_storage()
+        docfilter = self.docfilter
 
         load = pickle.load
         with tempstorage.open_file(filename).raw_file() as f:
@@ -145,6 +148,14 @@ class SubWriterTask(Process):
                 # Load the next pickled tuple from the file
                 code, args = load(f)
                 assert code == 0
+                # If the parent gave us a document filter, let it fill in (or
+                # veto) the fields here, so expensive work such as reading the
+                # document's content happens in parallel in the sub-tasks
+                if docfilter is not None:
+                    with timing(writer.stats, "filter_time"):
+                        args = docfilter(args)
+                    if args is None:
+                        continue
                 writer.add_document(**args)
         # Remove the job file
         tempstorage.delete_file(filename)
@@ -153,9 +164,22 @@ class SubWriterTask(Process):
         self.running = False
 
 
+def context_class(cls, context):
+    """Returns a subclass of the ``Process`` subclass ``cls`` whose processes
+    are started with the start method of the given ``multiprocessing``
+    context (e.g. ``multiprocessing.get_context("fork")``), or ``cls`` itself
+    if ``context`` is None.
+    """
+
+    if context is None:
+        return cls
+    return type(cls.__name__, (context.Process, cls), {})
+
+
 class MpWriter(SegmentWriter):
     def __init__(self, ix, procs=None, batchsize=100, subargs=None,
-                 multisegment=False, **kwargs):
+                 multisegment=False, docfilter=None, mpcontext=None,
+                 **kwargs):
         # This is the "main" writer that will aggregate the results created by
         # the sub-tasks
         SegmentWriter.__init__(self, ix, **kwargs)
@@ -170,13 +194,21 @@ class MpWriter(SegmentWriter):
         # If multisegment is True, don't merge the segments created by the
         # sub-writers, just add them directly to the TOC
         self.multisegment = multisegment
+        # An optional function called in the sub-tasks with each document's
+        # fields dictionary. It should return the (possibly modified)
+        # dictionary to index, or None to skip the document
+        self.docfilter = docfilter
+        # An optional multiprocessing context to start the sub-tasks with,
+        # None for the default start method
+        self.mpcontext = mpcontext
+        queue = mpcontext.Queue if mpcontext else Queue
 
         # A list to hold the sub-task Process objects
         self.tasks = []
         # A queue to pass the filenames of job files to the sub-tasks
-        self.jobqueue = Queue(self.procs * 4)
+        self.jobqueue = queue(self.procs * 4)
         # A queue to get back the final results of the sub-tasks
-        self.resultqueue = Queue()
+        self.resultqueue = queue()
         # A buffer for documents before they are flushed to a job file
         self.docbuffer = []
 
@@ -184,9 +216,10 @@ class MpWriter(SegmentWriter):
         self._added_sub = False
 
     def _new_task(self):
-        task = SubWriterTask(self.storage, self.indexname,
-                             self.jobqueue, self.resultqueue, self.subargs,
-                             self.multisegment)
+        cls = context_class(SubWriterTask, self.mpcontext)
+        task = cls(self.storage, self.indexname, self.jobqueue,
+                   self.resultqueue, self.subargs, self.multisegment,
+                   self.docfilter)
         self.tasks.append(task)
         task.start()
         return task
@@ -264,38 +297,46 @@ class MpWriter(SegmentWriter):
             self.jobqueue.put(None)
 
         # Merge existing segments
-        finalsegments = self._merge_segments(mergetype, optimize, merge)
+        with timing(self.stats, "merge_time"):
+            finalsegments = self._merge_segments(mergetype, optimize, merge)
 
         # Wait for the subtasks to finish
-        for task in self.tasks:
-            task.join()
+        with timing(self.stats, "wait_time"):
+            for task in self.tasks:
+                task.join()
 
-        # Pull a (run_file_name, fieldnames, segment) tuple off the result
-        # queue for each sub-task, representing the final results of the task
+        # Pull a (run_file_name, fieldnames, segment, stats) tuple off the
+        # result queue for each sub-task, representing the final results of
+        # the task
         results = []
         for task in self.tasks:
-            results.append(self.resultqueue.get(timeout=5))
-
-        if self.multisegment:
-            # If we're not merging the segments, we don't care about the runname
-            # and fieldnames in the results... just pull out the segments and
-            # add them to the list of final segments
-            finalsegments += [s for _, _, s in results]
-            if self._added:
-                finalsegments.append(self._finalize_segment())
+            runname, fieldnames, segment, stats = self.resultqueue.get(timeout=5)
+            # The timings of the sub-tasks are summed, they overlap in time
+            add_stats(self.stats, stats)
+            results.append((runname, fieldnames, segment))
+
+        with timing(self.stats, "flush_time"):
+            if self.multisegment:
+                # If we're not merging the segments, we don't care about the
+                # runname and fieldnames in the results... just pull out the
+                # segments and add them to the list of final segments
+                finalsegments += [s for _, _, s in results]
+                if self._added:
+                    finalsegments.append(self._finalize_segment())
+                else:
+                    self._close_segment()
+                assert self.perdocwriter.is_closed
             else:
+                # Merge the posting sources from the sub-writers and my
+                # postings into this writer
+                self._merge_subsegments(results, mergetype)
                 self._close_segment()
-            assert self.perdocwriter.is_closed
-        else:
-            # Merge the posting sources from the sub-writers and my
-            # postings into this writer
-            self._merge_subsegments(results, mergetype)
-            self._close_segment()
-            self._assemble_segment()
-            finalsegments.append(self.get_segment())
-            assert self.perdocwriter.is_closed
+                self._assemble_segment()
+                finalsegments.append(self.get_segment())
+                assert self.perdocwriter.is_closed
 
-        self._commit_toc(finalsegments)
+        with timing(self.stats, "toc_time"):
+            self._commit_toc(finalsegments)
         self._finish()
 
     def _merge_subsegments(self, results, mergetype):
@@ -339,18 +380,24 @@ class MpWriter(SegmentWriter):
 class SerialMpWriter(MpWriter):
     # A non-parallel version of the MpWriter for testing purposes
 
-    def __init__(self, ix, procs=None, batchsize=100, subargs=None, **kwargs):
+    def __init__(self, ix, procs=None, batchsize=100, subargs=None,
+                 docfilter=None, **kwargs):
         SegmentWriter.__init__(self, ix, **kwargs)
 
         self.procs = procs or cpu_count()
         self.batchsize = batchsize
         self.subargs = subargs if subargs else kwargs
+        self.docfilter = docfilter
         self.tasks = [SegmentWriter(ix, _lk=False, **self.subargs)
                       for _ in xrange(self.procs)]
         self.pointer = 0
         self._added_sub = False
 
     def add_document(self, **fields):
+        if self.docfilter is not None:
+            fields = self.docfilter(fields)
+            if fields is None:
+                return
         self.tasks[self.pointer].add_document(**fields)
         self.pointer = (self.pointer + 1) % len(self.tasks)
         self._added_sub = True
@@ -379,3 +426,44 @@ class MultiSegmentWriter(MpWriter):
     def __init__(self, *args, **kwargs):
         MpWriter.__init__(self, *args, **kwargs)
         self.multisegment = True
+
+
+# Merging in a separate process
+
+def merge_smallest(count):
+    """Returns a merge policy function which merges the ``count`` smallest
+    segments of the index.
+    """
+
+    def policy(writer, segments):
+        from whoosh.reading import SegmentReader
+
+        ordered = sorted(segments, key=lambda s: s.doc_count_all())
+        for seg in ordered[:count]:
+            reader = SegmentReader(writer.storage, writer.schema, seg)
+            writer.add_reader(reader)
+            reader.close()
+        return ordered[count:]
+    return policy
+
+
+class OptimizeTask(Process):
+    # This is a Process object that merges the segments of an index into one,
+    # like Index.optimize(), but "step" segments per commit. Terminating the
+    # process loses only the merge of the current step; the lock held by the
+    # writer is released when the process exits.
+
+    def __init__(self, storage, indexname, step=10, codec=None):
+        Process.__init__(self)
+        self.daemon = True
+        self.storage = storage
+        self.indexname = indexname
+        self.step = max(2, step)
+        # The codec of the merged segments, None for the default codec
+        self.codec = codec
+
+    def run(self):
+        ix = self.storage.open_index(self.indexname)
+        while len(ix._segments()) > 1:
+            writer = ix.writer(codec=self.codec)
+            writer.commit(mergetype=merge_smallest(self.step))
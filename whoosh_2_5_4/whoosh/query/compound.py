@@ -289,6 +289,7 @@ class Or(CompoundQuery):
     DEFAULT_MATCHER = 1  # Use a binary tree of UnionMatchers
     SPLIT_MATCHER = 2  # Use a different strategy for short and long queries
     ARRAY_MATCHER = 3  # Use a matcher that pre-loads docnums and scores
+    WAND_MATCHER = 4  # Use a matcher that skips docs that can't make the top N
     matcher_type = AUTO_MATCHER
 
     def __init__(self, subqueries, boost=1.0, minmatch=0, scale=None):
@@ -338,7 +339,15 @@ class Or(CompoundQuery):
 
         if matcher_type == self.AUTO_MATCHER:
             dc = searcher.doc_count_all()
-            if (len(subs) < self.TOO_MANY_CLAUSES
+            if (len(subs) > 2
+                and context and context.limit
+                and weighting and not weighting.use_final
+                and not needs_current
+                and not self.scale):
+                # If only the top N scored documents are wanted, skip the
+                # documents that can't make it
+                matcher_type = self.WAND_MATCHER
+            elif (len(subs) < self.TOO_MANY_CLAUSES
                 and (needs_current
                      or self.scale
                      or len(subs) == 2
@@ -361,6 +370,10 @@ class Or(CompoundQuery):
         elif matcher_type == self.ARRAY_MATCHER:
             # Implementation that pre-loads docnums and scores into an array
             cls = PreloadedOr
+        elif matcher_type == self.WAND_MATCHER:
+            # Implementation that skips documents whose maximum possible score
+            # can't make the top N
+            cls = WandOr
         else:
             raise ValueError("Unknown matcher_type %r" % self.matcher_type)
 
@@ -451,6 +464,24 @@ class PreloadedOr(Or):
         return am
 
 
+class WandOr(Or):
+    JOINT = " wOR "
+
+    def _matcher(self, subs, searcher, context):
+        ms = [sub.matcher(searcher, context) for sub in subs]
+        if not all(m.supports_block_quality() for m in ms):
+            # The maximum scores are needed to skip documents, so fall back to
+            # a binary tree of Union matchers
+            reader = searcher.reader()
+            w_subms = [(q.estimate_size(reader), m) for q, m in zip(subs, ms)]
+            m = make_weighted_tree(matching.UnionMatcher, w_subms)
+            if self.boost != 1.0:
+                m = matching.WrappingMatcher(m, self.boost)
+            return m
+
+        return matching.WandUnionMatcher(ms, boost=self.boost)
+
+
 class DisjunctionMax(CompoundQuery):
     """Matches all documents that match any of the subqueries, but scores each
     document using the maximum score from the subqueries.
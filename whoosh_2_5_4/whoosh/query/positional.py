@@ -223,6 +223,7 @@ class Phrase(qcore.Query):
                                    % self.fieldname)
 
         terms = []
+        freqs = []
         # Build a list of Term queries from the words in the phrase
         reader = searcher.reader()
         for word in self.words:
@@ -235,6 +236,14 @@ class Phrase(qcore.Query):
                 # Shortcut the query if one of the words doesn't exist.
                 return matching.NullMatcher()
             terms.append(Term(fieldname, word))
+            freqs.append(reader.doc_frequency(fieldname, word))
+
+        if self.slop == 1 and not field.format.supports("characters"):
+            # An exact phrase without character ranges to keep: compare the
+            # positions of the words directly, reading the rarest word first
+            ms = [t.matcher(searcher, context) for t in terms]
+            order = sorted(range(len(terms)), key=freqs.__getitem__)
+            return matching.PhraseMatcher(ms, boost=self.boost, order=order)
 
         # Create the equivalent SpanNear2 query from the terms
         q = SpanNear2(terms, slop=self.slop, ordered=True, mindist=1)
@@ -60,6 +60,16 @@ class TimeLimit(Exception):
     pass
 
 
+class SearchCancelled(Exception):
+    """Raised by :class:`whoosh.collectors.CancelCollector` if the search is
+    cancelled before it finishes. If you have a reference to the collector,
+    you can get partial results by calling
+    :meth:`~whoosh.collectors.CancelCollector.results`.
+    """
+
+    pass
+
+
 # Context class
 
 class SearchContext(object):
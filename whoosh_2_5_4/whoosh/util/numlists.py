@@ -1,11 +1,28 @@
 from array import array
 
-from whoosh.compat import xrange
-from whoosh.system import emptybytes
+from whoosh.compat import array_frombytes, xrange
+from whoosh.system import IS_LITTLE, emptybytes
 from whoosh.system import pack_byte, unpack_byte
 from whoosh.system import pack_ushort_le, unpack_ushort_le
 from whoosh.system import pack_uint_le, unpack_uint_le
 
+try:
+    int.from_bytes
+except AttributeError:
+    from binascii import hexlify, unhexlify
+
+    def _int_from_bytes(bs):
+        return int(hexlify(bs[::-1]), 16) if bs else 0
+
+    def _int_to_bytes(n, size):
+        return unhexlify("%0*x" % (size * 2, n))[::-1] if size else emptybytes
+else:
+    def _int_from_bytes(bs):
+        return int.from_bytes(bs, "little")
+
+    def _int_to_bytes(n, size):
+        return n.to_bytes(size, "little")
+
 
 def delta_encode(nums):
     base = 0
@@ -353,7 +370,7 @@ class GInts(NumberEncoding):
             elif code == 1:
                 yield f.read_ushort_le()
             elif code == 2:
-                yield unpack_uint_le(f.read(3) + "\x00")[0]
+                yield unpack_uint_le(f.read(3) + b"\x00")[0]
             else:
                 yield f.read_uint_le()
 
@@ -371,3 +388,70 @@ class GInts(NumberEncoding):
 #        for n in self.read_nums(f, (i + 1) - base):
 #            pass
 #        return n
+
+
+# Frame of reference: the smallest number is stored as a varint, followed by a
+# byte with the bit width of the largest difference from it and the
+# differences packed in that many bits each, little endian. The width is
+# rounded up to 1, 2, 4, 8, 16 or 32 bits, so that a whole block can be
+# unpacked with bytes.translate or loaded into an array instead of shifting
+# out the numbers one by one
+
+class FrameOfReference(NumberEncoding):
+    maxint = 2 ** 32 - 1
+    widths = (0, 1, 2, 4, 8, 16, 32)
+    _typecodes = {8: "B", 16: "H", 32: "I"}
+    # For the widths that pack several numbers in a byte, a translation table
+    # for each slot in the byte that maps a byte to the number in the slot
+    _tables = dict((width, [bytes(bytearray((i >> shift) & ((1 << width) - 1)
+                                            for i in xrange(256)))
+                            for shift in xrange(0, 8, width)])
+                   for width in (1, 2, 4))
+
+    @classmethod
+    def width(cls, n):
+        """Returns the packed bit width of numbers up to ``n``.
+        """
+
+        bits = n.bit_length()
+        for width in cls.widths:
+            if bits <= width:
+                return width
+        raise OverflowError("%r is too big to pack" % n)
+
+    def write_nums(self, f, numbers):
+        base = min(numbers) if numbers else 0
+        width = self.width(max(numbers) - base) if numbers else 0
+        packed = 0
+        shift = 0
+        for n in numbers:
+            packed |= (n - base) << shift
+            shift += width
+
+        f.write_varint(base)
+        f.write_byte(width)
+        f.write(_int_to_bytes(packed, (shift + 7) // 8))
+
+    def read_nums(self, f, n):
+        base = f.read_varint()
+        width = f.read_byte()
+        if not width:
+            return array("I", (base,)) * n
+
+        bs = f.read((n * width + 7) // 8)
+        if width in self._typecodes:
+            nums = array(self._typecodes[width])
+            array_frombytes(nums, bs)
+            if not IS_LITTLE:
+                nums.byteswap()
+        else:
+            tables = self._tables[width]
+            slots = len(tables)
+            unpacked = bytearray(len(bs) * slots)
+            for slot, table in enumerate(tables):
+                unpacked[slot::slots] = bs.translate(table)
+            nums = array("B", bytes(unpacked[:n]))
+
+        if base:
+            nums = array("I", [base + num for num in nums])
+        return nums
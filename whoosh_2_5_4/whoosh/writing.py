@@ -47,6 +47,29 @@ class IndexingError(Exception):
     pass
 
 
+# Indexing statistics
+
+@contextmanager
+def timing(stats, name):
+    """Adds the seconds spent in the block to ``stats[name]``.
+    """
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        stats[name] = stats.get(name, 0.0) + time.time() - start
+
+
+def add_stats(stats, other):
+    """Adds the timings and counters in the ``other`` dictionary to
+    ``stats``.
+    """
+
+    for name, value in other.items():
+        stats[name] = stats.get(name, 0) + value
+
+
 # Document grouping context manager
 
 @contextmanager
@@ -113,6 +136,91 @@ def CLEAR(writer, segments):
     return []
 
 
+class TieredMerge(object):
+    """Merge policy which groups segments into tiers by size, each tier
+    ``fanin`` times bigger than the one below it. When a tier has ``fanin``
+    segments, they are merged into one segment of the next tier, so a
+    document is rewritten about once per tier instead of at almost every
+    commit.
+
+    >>> policy = TieredMerge(fanin=8, maxmergemb=16)
+    >>> writer.commit(mergetype=policy)
+
+    The policy counts the merges it did in its ``stats`` dictionary.
+    """
+
+    def __init__(self, fanin=10, maxmergemb=32, floorkb=64):
+        """
+        :param fanin: the number of segments in a tier that triggers a merge,
+            and the most segments merged at once.
+        :param maxmergemb: the most megabytes of existing segments rewritten
+            by one commit.
+        :param floorkb: segments smaller than this many kilobytes are all in
+            the lowest tier.
+        """
+
+        self.fanin = max(2, fanin)
+        self.maxmergebytes = maxmergemb * 1024 * 1024
+        self.floorbytes = floorkb * 1024
+        self.stats = {"commits": 0, "merges": 0, "mergedsegments": 0,
+                      "mergedbytes": 0}
+
+    @staticmethod
+    def segment_size(storage, segment):
+        return sum(storage.file_length(name)
+                   for name in segment.list_files(storage))
+
+    def tier(self, size):
+        tier = 0
+        limit = self.floorbytes
+        while size >= limit:
+            tier += 1
+            limit *= self.fanin
+        return tier
+
+    def select(self, storage, segments):
+        """Returns the segments to merge and their total size in bytes.
+        """
+
+        tiers = {}
+        for seg in segments:
+            size = self.segment_size(storage, seg)
+            tiers.setdefault(self.tier(size), []).append((size, seg))
+
+        for tier in sorted(tiers):
+            sized = sorted(tiers[tier], key=lambda x: x[0])
+            if len(sized) < self.fanin:
+                continue
+            selected = []
+            total = 0
+            for size, seg in sized[:self.fanin]:
+                if selected and total + size > self.maxmergebytes:
+                    break
+                selected.append(seg)
+                total += size
+            if len(selected) > 1:
+                return selected, total
+        return [], 0
+
+    def __call__(self, writer, segments):
+        from whoosh.reading import SegmentReader
+
+        self.stats["commits"] += 1
+        selected, total = self.select(writer.storage, segments)
+        if not selected:
+            return list(segments)
+
+        ids = set(seg.segment_id() for seg in selected)
+        for seg in selected:
+            reader = SegmentReader(writer.storage, writer.schema, seg)
+            writer.add_reader(reader)
+            reader.close()
+        self.stats["merges"] += 1
+        self.stats["mergedsegments"] += len(selected)
+        self.stats["mergedbytes"] += total
+        return [seg for seg in segments if seg.segment_id() not in ids]
+
+
 # Customized sorting pool for postings
 
 class PostingPool(SortingPool):
@@ -128,6 +236,8 @@ class PostingPool(SortingPool):
         self.limit = limitmb * 1024 * 1024
         self.currentsize = 0
         self.fieldnames = set()
+        # Number of runs written to disk and the seconds it took
+        self.stats = {"spills": 0, "spill_time": 0.0}
 
     def _new_run(self):
         path = "%s.run" % random_name()
@@ -163,7 +273,10 @@ class PostingPool(SortingPool):
         return self.items()
 
     def save(self):
-        SortingPool.save(self)
+        if self.current:
+            self.stats["spills"] += 1
+        with timing(self.stats, "spill_time"):
+            SortingPool.save(self)
         self.currentsize = 0
 
 
@@ -534,6 +647,10 @@ class SegmentWriter(IndexWriter):
         self.optimize = False
         self.mergetype = None
 
+        # Seconds spent in the phases of indexing (keys ending in "_time")
+        # and counters, see indexing_stats()
+        self.stats = {"docs": 0, "postings": 0}
+
     def __repr__(self):
         return "<%s %r>" % (self.__class__.__name__, self.newsegment)
 
@@ -720,6 +837,10 @@ class SegmentWriter(IndexWriter):
         schema = self.schema
         docnum = self.docnum
         add_post = self.pool.add
+        poolstats = self.pool.stats
+        started = time.time()
+        spilled = poolstats["spill_time"]
+        postings = 0
 
         docboost = self._doc_boost(fields)
         fieldnames = sorted([name for name in fields.keys()
@@ -749,6 +870,7 @@ class SegmentWriter(IndexWriter):
                     if scorable:
                         length += freq
                     add_post((fieldname, tbytes, docnum, weight, vbytes))
+                    postings += 1
 
             if field.separate_spelling():
                 # For fields which use different morphemes for spelling,
@@ -787,6 +909,23 @@ class SegmentWriter(IndexWriter):
         self._added = True
         self.docnum += 1
 
+        # Time spent writing runs to disk is counted by the pool
+        stats = self.stats
+        stats["docs"] += 1
+        stats["postings"] += postings
+        stats["analyze_time"] = (stats.get("analyze_time", 0.0) + time.time()
+                                 - started - (poolstats["spill_time"] - spilled))
+
+    def indexing_stats(self):
+        """Returns a dictionary of the seconds spent in the phases of indexing
+        (keys ending in ``_time``) and the counters of this writer: documents
+        and postings added, and runs of postings spilled to disk.
+        """
+
+        stats = dict(self.stats)
+        add_stats(stats, self.pool.stats)
+        return stats
+
     def doc_count(self):
         return self.docnum - self.docbase
 
@@ -919,17 +1058,20 @@ class SegmentWriter(IndexWriter):
 
         self._check_state()
         # Merge old segments if necessary
-        finalsegments = self._merge_segments(mergetype, optimize, merge)
-        if self._added:
-            # Flush the current segment being written and add it to the
-            # list of remaining segments returned by the merge policy
-            # function
-            finalsegments.append(self._finalize_segment())
-        else:
-            # Close segment files
-            self._close_segment()
+        with timing(self.stats, "merge_time"):
+            finalsegments = self._merge_segments(mergetype, optimize, merge)
+        with timing(self.stats, "flush_time"):
+            if self._added:
+                # Flush the current segment being written and add it to the
+                # list of remaining segments returned by the merge policy
+                # function
+                finalsegments.append(self._finalize_segment())
+            else:
+                # Close segment files
+                self._close_segment()
         # Write TOC
-        self._commit_toc(finalsegments)
+        with timing(self.stats, "toc_time"):
+            self._commit_toc(finalsegments)
 
         # Final cleanup
         self._finish()